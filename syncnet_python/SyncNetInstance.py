@@ -11,6 +11,9 @@ import python_speech_features
 from scipy import signal
 from scipy.io import wavfile
 from SyncNetModel import *
+from embedding_store import EmbeddingStore, file_hash
+from embedding_codec import EmbeddingCodec, EncodedFeatures, calc_pdist_encoded
+from frame_store import read_frames
 from shutil import rmtree
 
 
@@ -30,19 +33,213 @@ def calc_pdist(feat1, feat2, vshift=10):
 
     return dists
 
+def calc_pdist_wide(feat1, feat2, vshift=10, block_size=256):
+    """Distances for every shift in [-vshift, vshift] as one (N, 2*vshift+1) tensor.
+
+    Gives the same values as stacking calc_pdist, zero padding included, but
+    expands |a-b|^2 = |a|^2 + |b|^2 - 2ab and takes the dot products for a block
+    of frames from one matrix product, so wide searches cost a few GEMMs rather
+    than a Python loop over frames.
+    """
+
+    feat2p = torch.nn.functional.pad(feat2,(0,0,vshift,vshift))
+
+    return calc_pdist_band(feat1, feat2p, vshift*2+1, block_size)
+
+def calc_pdist_band(feat1, feat2p, win_size, block_size=256):
+    """calc_pdist_wide on an already padded feat2: row i of the result holds the
+    distances of feat1[i] to feat2p[i:i+win_size]."""
+
+    sq1 = (feat1**2).sum(1)
+    sq2 = (feat2p**2).sum(1)
+
+    dists = []
+
+    for i in range(0,len(feat1),block_size):
+
+        a = feat1[i:i+block_size]
+        b = feat2p[i:i+len(a)+win_size-1]
+
+        # Row r of the band holds the dot products of a[r] with b[r:r+win_size]
+        idx = torch.arange(len(a)).unsqueeze(1) + torch.arange(win_size).unsqueeze(0)
+        band = torch.mm(a, b.t()).gather(1, idx)
+
+        d2 = sq1[i:i+len(a)].unsqueeze(1) + sq2[i+idx] - 2*band
+        dists.append(d2.clamp(min=0).sqrt())
+
+    return torch.cat(dists,0)
+
+def shift_embeddings(im_feat, cc_feat, offset):
+    """Pair lip and audio embeddings as they would be after delaying the audio
+    by `offset` frames, the correction for a detected AV offset of `offset`.
+
+    Frames that lose their partner at either end are dropped instead of padded.
+    """
+    offset = int(round(float(offset)))
+    if offset > 0:
+        im_feat, cc_feat = im_feat[offset:], cc_feat[:len(cc_feat)-offset]
+    elif offset < 0:
+        im_feat, cc_feat = im_feat[:len(im_feat)+offset], cc_feat[-offset:]
+    length = min(len(im_feat), len(cc_feat))
+    return im_feat[:length], cc_feat[:length]
+
+def coarse_to_fine_order(num_segments):
+    """Segment indices 0..num_segments-1 in bit-reversed order: the first, then
+    the middle, then the quarters and so on, so any prefix is spread evenly
+    over the clip."""
+    bits = max(num_segments-1, 0).bit_length()
+    order = [int(format(k, '0%db' % bits)[::-1], 2) if bits else 0 for k in range(1 << bits)]
+    return [k for k in order if k < num_segments]
+
+# ==================== DRIFT ====================
+
+def estimate_drift(dists, vshift, segment=250, hop=None, frame_rate=25):
+    """Piecewise offset timeline from one per-frame distance matrix.
+
+    dists is the (N, 2*vshift+1) matrix returned by evaluate. The mean-distance
+    curve of every segment of `segment` frames, taken every `hop` frames, comes
+    from a cumulative sum over the time axis, so no segment is re-evaluated.
+    A line fitted to the segment offsets, weighted by confidence, gives the
+    drift rate in frames per second and the offset at t = 0.
+    """
+    dists = numpy.asarray(dists, dtype=numpy.float64)
+    segment = min(segment, len(dists))
+    hop = hop or max(segment//2, 1)
+
+    csum = numpy.concatenate([numpy.zeros((1,dists.shape[1])), numpy.cumsum(dists,0)])
+    starts = numpy.arange(0, len(dists)-segment+1, hop)
+    mdist = (csum[starts+segment] - csum[starts]) / segment
+
+    minidx = numpy.argmin(mdist,1)
+    minval = mdist[numpy.arange(len(starts)),minidx]
+    offset = vshift - minidx
+    conf = numpy.median(mdist,1) - minval
+    time = (starts + segment/2.0) / frame_rate
+
+    weights = numpy.maximum(conf,0)
+    if numpy.count_nonzero(weights) >= 2:
+        rate, intercept = numpy.polyfit(time, offset, 1, w=numpy.sqrt(weights))
+    else:
+        rate, intercept = 0.0, float(numpy.median(offset))
+
+    return {'start': starts, 'end': starts+segment, 'time': time, 'offset': offset, 'conf': conf,
+            'drift_rate': float(rate), 'intercept': float(intercept), 'frame_rate': frame_rate}
+
+# ==================== MFCC ====================
+
+def compute_mfcc(audio, sample_rate=16000):
+    """13 x N MFCC matrix, one column per 10 ms."""
+    mfcc = zip(*python_speech_features.mfcc(audio,sample_rate))
+    return numpy.stack([numpy.array(i) for i in mfcc])
+
+# ==================== BATCHES ====================
+
+def video_tensor(images):
+    """(T, H, W, 3) uint8 frames as a (1, 3, T, H, W) float tensor."""
+    im = numpy.expand_dims(images,axis=0)
+    im = numpy.transpose(im,(0,4,1,2,3))
+    return torch.autograd.Variable(torch.from_numpy(im.astype(float)).float())
+
+def lip_batch(imtv, start, stop):
+    """The 5-frame windows starting at frames [start, stop) as one batch."""
+    return torch.cat([ imtv[:,:,vframe:vframe+5,:,:] for vframe in range(start,stop) ],0)
+
+def mfcc_tensor(mfcc):
+    """13 x N MFCC matrix as a (1, 1, 13, N) float tensor."""
+    cc = numpy.expand_dims(numpy.expand_dims(mfcc,axis=0),axis=0)
+    return torch.autograd.Variable(torch.from_numpy(cc.astype(float)).float())
+
+def aud_batch(cct, start, stop):
+    """The 20-step MFCC windows of video frames [start, stop) as one batch."""
+    return torch.cat([ cct[:,:,:,vframe*4:vframe*4+20] for vframe in range(start,stop) ],0)
+
+# ==================== ACTIVE SPEAKER ====================
+
+def active_speaker_matrix(im_feats, start_frames, cc_feat, num_frames=None, offset=0, kernel_size=9):
+    """Score every track against the shared audio embeddings for all frames at once.
+
+    im_feats[t] holds the lip embeddings of track t, whose first window starts at
+    start_frames[t]; cc_feat is embed_audio output over the whole reference.
+    Returns a (num_tracks, num_frames) confidence matrix, NaN where a track is
+    not on screen, and the index of the speaking track per frame (-1 if none).
+    """
+    if num_frames is None:
+        num_frames = len(cc_feat)
+    if not im_feats:
+        return numpy.full((0, num_frames), numpy.nan), numpy.full(num_frames, -1)
+
+    lengths = [len(feat) for feat in im_feats]
+    rows = numpy.repeat(numpy.arange(len(im_feats)), lengths)
+    cols = numpy.concatenate([numpy.arange(start, start+length) for start, length in zip(start_frames, lengths)]) if lengths else numpy.zeros(0, dtype=int)
+
+    # One batched distance over every (track, frame) pair that has audio
+    aud = cols + offset
+    valid = (aud >= 0) & (aud < len(cc_feat)) & (cols < num_frames)
+    dist = torch.nn.functional.pairwise_distance(torch.cat(im_feats,0)[torch.from_numpy(numpy.flatnonzero(valid))], cc_feat[torch.from_numpy(aud[valid])]).numpy()
+
+    conf = numpy.full((len(im_feats), num_frames), numpy.nan)
+    conf[rows[valid], cols[valid]] = dist
+
+    for t in range(len(im_feats)):
+        seg = ~numpy.isnan(conf[t])
+        if seg.any():
+            conf[t,seg] = signal.medfilt(numpy.median(conf[t,seg]) - conf[t,seg], kernel_size=kernel_size)
+
+    filled = numpy.where(numpy.isnan(conf), -numpy.inf, conf)
+    speaker = numpy.where(numpy.isnan(conf).all(0), -1, numpy.argmax(filled, 0))
+
+    return conf, speaker
+
 # ==================== MAIN DEF ====================
 
 class SyncNetInstance(torch.nn.Module):
 
-    def __init__(self, dropout = 0, num_layers_in_fc_layers = 1024):
+    def __init__(self, dropout = 0, num_layers_in_fc_layers = 1024, store = None, codec = None):
         super(SyncNetInstance, self).__init__();
 
         self.__S__ = S(num_layers_in_fc_layers = num_layers_in_fc_layers).cuda();
 
+        # Optional EmbeddingStore consulted before any decoding or embedding
+        self.store = store
+        self.model_version = 'init'
+
+        # Optional EmbeddingCodec; embeddings are then stored and compared compressed
+        self.codec = codec
+
     def evaluate(self, opt, videofile):
 
+        im_feat, cc_feat = self.embed_file(opt, videofile)
+
+        return self.compute_offset(opt, im_feat, cc_feat)
+
+    def embed_file(self, opt, videofile):
+        """Lip and audio embeddings of a video file, from the store when present."""
+
         self.__S__.eval();
 
+        if self.store is not None:
+            params = {'codec': self.codec.name} if self.codec is not None else {}
+            key = EmbeddingStore.key(file_hash(videofile), self.model_version, lip_window=5, mfcc_window=20, mfcc_step=4, **params)
+            if self.store.has(key, 'lip', 'aud'):
+                print('Embeddings for %s found in store.' % videofile)
+                return self._load_embeddings(key, 'lip'), self._load_embeddings(key, 'aud')
+
+        images, audio, sample_rate = self.load_file(opt, videofile)
+
+        im_feat, cc_feat, mfcc = self.embed_frames(opt, images, audio, sample_rate)
+
+        if self.codec is not None:
+            im_feat, cc_feat = self.codec.encode(im_feat), self.codec.encode(cc_feat)
+
+        if self.store is not None:
+            arrays = dict(self._store_arrays('lip', im_feat), **self._store_arrays('aud', cc_feat))
+            self.store.put(key, mfcc=mfcc.T.astype(numpy.float32), **arrays)
+
+        return im_feat, cc_feat
+
+    def load_file(self, opt, videofile):
+        """Decode a video file to a (T, H, W, 3) uint8 frame array and 16 kHz mono PCM."""
+
         # ========== ==========
         # Convert files
         # ========== ==========
@@ -52,9 +249,6 @@ class SyncNetInstance(torch.nn.Module):
 
         os.makedirs(os.path.join(opt.tmp_dir,opt.reference))
 
-        command = ("ffmpeg -y -i %s -threads 1 -f image2 %s" % (videofile,os.path.join(opt.tmp_dir,opt.reference,'%06d.jpg'))) 
-        output = subprocess.call(command, shell=True, stdout=None)
-
         command = ("ffmpeg -y -i %s -async 1 -ac 1 -vn -acodec pcm_s16le -ar 16000 %s" % (videofile,os.path.join(opt.tmp_dir,opt.reference,'audio.wav'))) 
         output = subprocess.call(command, shell=True, stdout=None)
         
@@ -62,30 +256,142 @@ class SyncNetInstance(torch.nn.Module):
         # Load video 
         # ========== ==========
 
-        images = []
-        
-        flist = glob.glob(os.path.join(opt.tmp_dir,opt.reference,'*.jpg'))
-        flist.sort()
-
-        for fname in flist:
-            images.append(cv2.imread(fname))
-
-        im = numpy.stack(images,axis=3)
-        im = numpy.expand_dims(im,axis=0)
-        im = numpy.transpose(im,(0,3,4,1,2))
-
-        imtv = torch.autograd.Variable(torch.from_numpy(im.astype(float)).float())
+        # Raw frames straight from ffmpeg into memory instead of one JPEG per frame
+        images = read_frames(videofile)
 
         # ========== ==========
         # Load audio
         # ========== ==========
 
         sample_rate, audio = wavfile.read(os.path.join(opt.tmp_dir,opt.reference,'audio.wav'))
-        mfcc = zip(*python_speech_features.mfcc(audio,sample_rate))
-        mfcc = numpy.stack([numpy.array(i) for i in mfcc])
 
-        cc = numpy.expand_dims(numpy.expand_dims(mfcc,axis=0),axis=0)
-        cct = torch.autograd.Variable(torch.from_numpy(cc.astype(float)).float())
+        return images, audio, sample_rate
+
+    @staticmethod
+    def _store_arrays(kind, feat):
+        if isinstance(feat, EncodedFeatures):
+            arrays = {kind: feat.data}
+            if feat.scale is not None:
+                arrays[kind + '_scale'] = feat.scale[:, None]
+            return arrays
+        return {kind: feat.numpy()}
+
+    def _load_embeddings(self, key, kind):
+        data = numpy.array(self.store.get(key, kind))
+        if self.codec is None:
+            return torch.from_numpy(data)
+        scale = numpy.array(self.store.get(key, kind + '_scale'))[:, 0] if self.store.has(key, kind + '_scale') else None
+        return EncodedFeatures(data, scale)
+
+    def evaluate_frames(self, opt, images, audio, sample_rate=16000):
+        """Evaluate in-memory inputs: images is a (T, H, W, 3) uint8 BGR array of
+        25 fps frames, audio the matching 16 kHz mono PCM samples."""
+
+        im_feat, cc_feat, mfcc = self.embed_frames(opt, images, audio, sample_rate)
+
+        return self.compute_offset(opt, im_feat, cc_feat)
+
+    def evaluate_progressive(self, opt, videofile, **kwargs):
+        """evaluate with early exit, see evaluate_frames_progressive.
+        Returns (offset, conf, dists, fraction of the clip embedded)."""
+
+        if self.store is not None:
+            params = {'codec': self.codec.name} if self.codec is not None else {}
+            key = EmbeddingStore.key(file_hash(videofile), self.model_version, lip_window=5, mfcc_window=20, mfcc_step=4, **params)
+            if self.store.has(key, 'lip', 'aud'):
+                # Stored embeddings cost nothing to score in full
+                return self.evaluate(opt, videofile) + (1.0,)
+
+        images, audio, sample_rate = self.load_file(opt, videofile)
+
+        return self.evaluate_frames_progressive(opt, images, audio, sample_rate, **kwargs)
+
+    def evaluate_frames_progressive(self, opt, images, audio, sample_rate=16000, segment=25, min_windows=125, patience=3, min_conf=3.0):
+        """Embed the clip segment by segment in coarse-to-fine order and stop early.
+
+        Segments of `segment` windows are taken in the order of
+        coarse_to_fine_order, so the windows seen so far are always spread over
+        the whole clip. The mean-distance curve is updated after each segment;
+        once min_windows have been seen, the search stops when the best offset
+        has been the same for `patience` segments and the confidence is at
+        least min_conf. Otherwise every segment is embedded and the result is
+        that of evaluate_frames.
+
+        Returns (offset, conf, dists, fraction), where fraction is the share of
+        the windows that were embedded and dists rows of windows that were
+        not are NaN.
+        """
+
+        self.__S__.eval();
+
+        min_length = min(len(images),math.floor(len(audio)/640))
+        num_windows = min_length-5
+        win_size = opt.vshift*2+1
+
+        tS = time.time()
+        mfcc = compute_mfcc(audio, sample_rate)
+
+        im_feat = cc_feat = None
+        cc_done = numpy.zeros(num_windows, dtype=bool)
+        dists = torch.full((num_windows, win_size), float('nan'))
+        dsum = torch.zeros(win_size, dtype=torch.float64)
+        seen = 0
+        history = []
+
+        for seg in coarse_to_fine_order(int(math.ceil(num_windows/float(segment)))):
+
+            start, stop = seg*segment, min((seg+1)*segment, num_windows)
+
+            seg_feat = self.embed_video(opt, images[start:stop+4], stop-start)
+            if im_feat is None:
+                im_feat = torch.zeros(num_windows, seg_feat.shape[1])
+                cc_feat = torch.zeros(num_windows, seg_feat.shape[1])
+            im_feat[start:stop] = seg_feat
+
+            # Audio windows within vshift of the segment that are not embedded yet
+            lo, hi = max(start-opt.vshift, 0), min(stop+opt.vshift, num_windows)
+            missing = numpy.flatnonzero(~cc_done[lo:hi]) + lo
+            for run in numpy.split(missing, numpy.flatnonzero(numpy.diff(missing) > 1) + 1):
+                if len(run):
+                    a, b = int(run[0]), int(run[-1])+1
+                    cc_feat[a:b] = self.embed_audio(opt, None, sample_rate, b-a, mfcc=mfcc[:,a*4:(b-1)*4+20])
+                    cc_done[a:b] = True
+
+            feat2p = torch.zeros(stop-start+win_size-1, cc_feat.shape[1])
+            feat2p[lo-(start-opt.vshift):hi-(start-opt.vshift)] = cc_feat[lo:hi]
+            dists[start:stop] = calc_pdist_band(seg_feat, feat2p, win_size)
+
+            dsum += dists[start:stop].sum(0).double()
+            seen += stop-start
+
+            if seen >= num_windows:
+                break
+
+            mdist = dsum / seen
+            minidx = int(torch.argmin(mdist))
+            history.append(opt.vshift-minidx)
+            conf = float(torch.median(mdist) - mdist[minidx])
+
+            if seen >= min_windows and len(history) >= patience and len(set(history[-patience:])) == 1 and conf >= min_conf:
+                break
+
+        fraction = seen / float(num_windows)
+        print('Compute time %.3f sec, %d of %d windows (%.0f%%).' % (time.time()-tS, seen, num_windows, 100*fraction))
+
+        if seen >= num_windows:
+            offset, conf, dists_npy = self.compute_offset(opt, im_feat, cc_feat)
+            return offset, conf, dists_npy, 1.0
+
+        mdist = (dsum / seen).float()
+        minval, minidx = torch.min(mdist,0)
+        offset = opt.vshift-minidx
+        conf   = torch.median(mdist) - minval
+        print('AV offset: \t%d \nMin dist: \t%.3f\nConfidence: \t%.3f' % (offset,minval,conf))
+
+        return offset.numpy(), conf.numpy(), dists.numpy(), fraction
+
+    def embed_frames(self, opt, images, audio, sample_rate=16000):
+        """Lip and audio embeddings over the common length of the inputs, plus the MFCC."""
 
         # ========== ==========
         # Check audio and video input length
@@ -101,40 +407,94 @@ class SyncNetInstance(torch.nn.Module):
         # ========== ==========
 
         lastframe = min_length-5
-        im_feat = []
-        cc_feat = []
 
         tS = time.time()
-        for i in range(0,lastframe,opt.batch_size):
+        mfcc = compute_mfcc(audio, sample_rate)
+        im_feat = self.embed_video(opt, images, lastframe)
+        cc_feat = self.embed_audio(opt, audio, sample_rate, lastframe, mfcc=mfcc)
+        print('Compute time %.3f sec.' % (time.time()-tS))
+
+        return im_feat, cc_feat, mfcc
+
+    def evaluate_track(self, opt, images, cc_feat, start_frame):
+        """Evaluate a face track against audio embeddings of the whole reference.
+
+        cc_feat comes from embed_audio over the full reference timeline and is
+        sliced at the track's first frame, so the audio tower never runs per track.
+        Returns (offset, conf, dists, im_feat).
+        """
+        lastframe = min(len(images)-4, len(cc_feat)-start_frame)
+
+        tS = time.time()
+        im_feat = self.embed_video(opt, images, lastframe)
+        print('Compute time %.3f sec.' % (time.time()-tS))
+
+        offset, conf, dists_npy = self.compute_offset(opt, im_feat, cc_feat[start_frame:start_frame+lastframe])
+        return offset, conf, dists_npy, im_feat
+
+    def embed_video(self, opt, images, num_windows=None):
+        """Lip embeddings of every 5-frame window of a (T, H, W, 3) uint8 array."""
+
+        self.__S__.eval();
+
+        if num_windows is None:
+            num_windows = len(images)-4
+
+        imtv = video_tensor(images)
+
+        im_feat = []
+        for i in range(0,num_windows,opt.batch_size):
             
-            im_batch = [ imtv[:,:,vframe:vframe+5,:,:] for vframe in range(i,min(lastframe,i+opt.batch_size)) ]
-            im_in = torch.cat(im_batch,0)
+            im_in = lip_batch(imtv, i, min(num_windows,i+opt.batch_size))
             im_out  = self.__S__.forward_lip(im_in.cuda());
             im_feat.append(im_out.data.cpu())
 
-            cc_batch = [ cct[:,:,:,vframe*4:vframe*4+20] for vframe in range(i,min(lastframe,i+opt.batch_size)) ]
-            cc_in = torch.cat(cc_batch,0)
+        return torch.cat(im_feat,0)
+
+    def embed_audio(self, opt, audio, sample_rate=16000, num_windows=None, mfcc=None):
+        """Audio embeddings of every 20-step MFCC window, one per video frame (640 samples)."""
+
+        self.__S__.eval();
+
+        if mfcc is None:
+            mfcc = compute_mfcc(audio, sample_rate)
+
+        if num_windows is None:
+            num_windows = (mfcc.shape[1]-20)//4+1
+
+        cct = mfcc_tensor(mfcc)
+
+        cc_feat = []
+        for i in range(0,num_windows,opt.batch_size):
+
+            cc_in = aud_batch(cct, i, min(num_windows,i+opt.batch_size))
             cc_out  = self.__S__.forward_aud(cc_in.cuda())
             cc_feat.append(cc_out.data.cpu())
 
-        im_feat = torch.cat(im_feat,0)
-        cc_feat = torch.cat(cc_feat,0)
+        return torch.cat(cc_feat,0)
 
-        # ========== ==========
-        # Compute offset
-        # ========== ==========
-            
-        print('Compute time %.3f sec.' % (time.time()-tS))
+    def compute_offset(self, opt, im_feat, cc_feat):
 
-        dists = calc_pdist(im_feat,cc_feat,vshift=opt.vshift)
-        mdist = torch.mean(torch.stack(dists,1),1)
+        # With a codec, distances are computed on the compressed embeddings
+        if self.codec is not None or isinstance(im_feat, EncodedFeatures):
+            if not isinstance(im_feat, EncodedFeatures):
+                im_feat = self.codec.encode(im_feat)
+            if not isinstance(cc_feat, EncodedFeatures):
+                cc_feat = self.codec.encode(cc_feat)
+            dists = calc_pdist_encoded(im_feat,cc_feat,vshift=opt.vshift)
+        # opt.search == 'wide' scores all shifts with matrix products, for large vshift
+        elif getattr(opt, 'search', 'narrow') == 'wide':
+            dists = calc_pdist_wide(im_feat,cc_feat,vshift=opt.vshift)
+        else:
+            dists = torch.stack(calc_pdist(im_feat,cc_feat,vshift=opt.vshift),0)
+        mdist = torch.mean(dists,0)
 
         minval, minidx = torch.min(mdist,0)
 
         offset = opt.vshift-minidx
         conf   = torch.median(mdist) - minval
 
-        fdist   = numpy.stack([dist[minidx].numpy() for dist in dists])
+        fdist   = dists[:,minidx].numpy()
         # fdist   = numpy.pad(fdist, (3,3), 'constant', constant_values=15)
         fconf   = torch.median(mdist).numpy() - fdist
         fconfm  = signal.medfilt(fconf,kernel_size=9)
@@ -144,12 +504,25 @@ class SyncNetInstance(torch.nn.Module):
         print(fconfm)
         print('AV offset: \t%d \nMin dist: \t%.3f\nConfidence: \t%.3f' % (offset,minval,conf))
 
-        dists_npy = numpy.array([ dist.numpy() for dist in dists ])
+        dists_npy = dists.numpy()
         return offset.numpy(), conf.numpy(), dists_npy
 
+    def verify_offset(self, opt, im_feat, cc_feat, offset):
+        """Re-score embeddings with the audio shifted by an applied correction of
+        `offset` frames. A correct correction leaves a residual offset of 0.
+        Returns (residual offset, conf, dists) as compute_offset does.
+        """
+        return self.compute_offset(opt, *shift_embeddings(im_feat, cc_feat, offset))
+
     def extract_feature(self, opt, videofile):
 
         self.__S__.eval();
+
+        if self.store is not None:
+            key = EmbeddingStore.key(file_hash(videofile), self.model_version, lip_window=5)
+            if self.store.has(key, 'lipfeat'):
+                print('Features for %s found in store.' % videofile)
+                return torch.from_numpy(numpy.array(self.store.get(key, 'lipfeat')))
         
         # ========== ==========
         # Load video 
@@ -195,12 +568,23 @@ class SyncNetInstance(torch.nn.Module):
             
         print('Compute time %.3f sec.' % (time.time()-tS))
 
+        if self.store is not None:
+            self.store.put(key, lipfeat=im_feat.numpy())
+
         return im_feat
 
 
     def loadParameters(self, path):
+        # A directory holds TorchScript towers written by export_syncnet.py
+        if os.path.isdir(path):
+            self.__S__ = FrozenS(path);
+            self.model_version = self.__S__.model_version or file_hash(os.path.join(path, 'lip.pt'))[:16];
+            return
+
         loaded_state = torch.load(path, map_location=lambda storage, loc: storage);
 
+        self.model_version = file_hash(path)[:16];
+
         self_state = self.__S__.state_dict();
 
         for name, param in loaded_state.items():
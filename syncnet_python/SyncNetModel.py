@@ -1,6 +1,8 @@
 #!/usr/bin/python
 #-*- coding: utf-8 -*-
 
+import os
+import copy
 import torch
 import torch.nn as nn
 
@@ -114,4 +116,105 @@ class S(nn.Module):
         mid = self.netcnnlip(x);
         out = mid.view((mid.size()[0], -1)); # N x (ch x 24)
 
-        return out;
\ No newline at end of file
+        return out;
+
+# ==================== INFERENCE GRAPH ====================
+
+def fuse_bn(layer, bn):
+    """Fold an eval-mode BatchNorm into the conv or linear layer before it."""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shape = (-1,) + (1,) * (layer.weight.dim() - 1)
+    bias = layer.bias if layer.bias is not None else torch.zeros_like(bn.running_mean)
+
+    fused = copy.deepcopy(layer)
+    fused.weight = nn.Parameter((layer.weight * scale.view(shape)).detach())
+    fused.bias = nn.Parameter(((bias - bn.running_mean) * scale + bn.bias).detach())
+    return fused
+
+def fold_sequential(seq):
+    """Copy of an nn.Sequential with every BatchNorm folded into the preceding
+    layer and 1x1 stride-1 max pools, which are identities, removed."""
+    layers = []
+    for layer in seq:
+        if isinstance(layer, nn.modules.batchnorm._BatchNorm):
+            layers[-1] = fuse_bn(layers[-1], layer)
+        elif isinstance(layer, (nn.MaxPool2d, nn.MaxPool3d)) and _is_identity_pool(layer):
+            continue
+        else:
+            layers.append(copy.deepcopy(layer))
+    return nn.Sequential(*layers)
+
+def _is_identity_pool(pool):
+    kernel = pool.kernel_size if isinstance(pool.kernel_size, tuple) else (pool.kernel_size,)
+    stride = pool.stride if isinstance(pool.stride, tuple) else (pool.stride,)
+    padding = pool.padding if isinstance(pool.padding, tuple) else (pool.padding,)
+    return all(k == 1 for k in kernel) and all(s == 1 for s in stride) and all(p == 0 for p in padding)
+
+class Tower(nn.Module):
+    """One SyncNet stream: a conv stack, flattened, optionally followed by the FC head."""
+
+    def __init__(self, cnn, fc=None):
+        super(Tower, self).__init__();
+        self.cnn = cnn
+        self.fc = fc if fc is not None else nn.Identity()
+
+    def forward(self, x):
+        mid = self.cnn(x);
+        return self.fc(mid.view((mid.size()[0], -1)));
+
+# Example input shapes of the towers, batch dimension excluded
+TOWER_INPUTS = {'lip': (3, 5, 224, 224), 'lipfeat': (3, 5, 224, 224), 'aud': (1, 13, 20)}
+
+def build_towers(model, fold=True):
+    """Eval-mode lip, lip-feature and audio towers of S, with BN folded unless fold=False."""
+    model = model.eval()
+    prep = fold_sequential if fold else copy.deepcopy
+    cnnlip = prep(model.netcnnlip)
+    towers = {
+        'lip': Tower(cnnlip, prep(model.netfclip)),
+        'lipfeat': Tower(cnnlip),
+        'aud': Tower(prep(model.netcnnaud), prep(model.netfcaud)),
+    }
+    return {name: tower.eval() for name, tower in towers.items()}
+
+def export_towers(model, output_dir, device='cuda', model_version=''):
+    """Trace, freeze and save every tower as output_dir/<name>.pt.
+
+    torch.jit.freeze needs torch 1.8; on the pinned 1.4 the towers are saved
+    traced but not frozen, with BatchNorm still folded by build_towers.
+
+    model_version is stored in each file so that embeddings cached under the
+    source model's version stay valid for the exported graph.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    frozen = {}
+    for name, tower in build_towers(model).items():
+        tower = tower.to(device)
+        example = torch.zeros((2,) + TOWER_INPUTS[name], device=device)
+        with torch.no_grad():
+            traced = torch.jit.trace(tower, example)
+            if hasattr(torch.jit, 'freeze'):
+                traced = torch.jit.freeze(traced)
+        torch.jit.save(traced, os.path.join(output_dir, name + '.pt'), _extra_files={'model_version': model_version})
+        frozen[name] = traced
+    return frozen
+
+class FrozenS(nn.Module):
+    """Drop-in replacement for S at inference, backed by exported TorchScript towers."""
+
+    def __init__(self, path, device='cuda'):
+        super(FrozenS, self).__init__();
+        extra = {'model_version': ''}
+        self.lip = torch.jit.load(os.path.join(path, 'lip.pt'), map_location=device, _extra_files=extra)
+        self.model_version = extra['model_version'].decode('utf-8') if isinstance(extra['model_version'], bytes) else extra['model_version']
+        self.lipfeat = torch.jit.load(os.path.join(path, 'lipfeat.pt'), map_location=device)
+        self.aud = torch.jit.load(os.path.join(path, 'aud.pt'), map_location=device)
+
+    def forward_aud(self, x):
+        return self.aud(x);
+
+    def forward_lip(self, x):
+        return self.lip(x);
+
+    def forward_lipfeat(self, x):
+        return self.lipfeat(x);
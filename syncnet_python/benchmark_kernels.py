@@ -0,0 +1,225 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os, io, json, math, time, timeit, platform, argparse, contextlib, warnings
+import numpy as np
+import torch
+
+# ==================== KERNELS ====================
+#
+# Each setup function builds deterministic synthetic inputs and returns the
+# callable to time. Modules are imported inside the setups so that a kernel
+# whose dependencies are missing is skipped instead of failing the suite.
+
+def _rng():
+    return np.random.RandomState(0)
+
+def _boxes(rng, n, size=640.):
+    xy = rng.uniform(0, size, (n, 2))
+    wh = rng.uniform(16, 128, (n, 2))
+    return np.concatenate([xy, xy + wh], 1)
+
+def _fmaps(h, w):
+    return [[int(math.ceil(h / float(step))), int(math.ceil(w / float(step)))] for step in [4, 8, 16, 32, 64, 128]]
+
+def setup_calc_pdist():
+    from SyncNetInstance import calc_pdist
+    torch.manual_seed(0)
+    a, b = torch.randn(500, 1024), torch.randn(500, 1024)
+    return lambda: calc_pdist(a, b, vshift=15)
+
+def setup_calc_pdist_wide():
+    from SyncNetInstance import calc_pdist_wide
+    torch.manual_seed(0)
+    a, b = torch.randn(500, 1024), torch.randn(500, 1024)
+    return lambda: calc_pdist_wide(a, b, vshift=15)
+
+def setup_nms_():
+    from detectors.s3fd.box_utils import nms_
+    rng = _rng()
+    dets = np.concatenate([_boxes(rng, 2000), rng.uniform(0, 1, (2000, 1))], 1).astype(np.float32)
+    return lambda: nms_(dets, 0.3)
+
+def setup_box_utils_nms():
+    from detectors.s3fd.box_utils import nms
+    rng = _rng()
+    boxes = torch.from_numpy(_boxes(rng, 5000).astype(np.float32))
+    scores = torch.from_numpy(rng.uniform(0, 1, 5000).astype(np.float32))
+    return lambda: nms(boxes, scores, 0.3, 5000)
+
+def setup_detect_forward():
+    from detectors.s3fd.box_utils import Detect, PriorBox
+    torch.manual_seed(0)
+    priors = PriorBox((180, 320), _fmaps(180, 320)).forward()
+    loc = torch.randn(1, len(priors), 4) * 0.1
+    conf = torch.softmax(torch.randn(1, len(priors), 2) * 3, -1)
+    detect = Detect()
+    return lambda: detect.forward(loc, conf, priors)
+
+def setup_priorbox_forward():
+    from detectors.s3fd.box_utils import PriorBox
+    priorbox = PriorBox((180, 320), _fmaps(180, 320))
+    return priorbox.forward
+
+def setup_mfcc():
+    from SyncNetInstance import compute_mfcc
+    audio = (_rng().randn(16000 * 10) * 3000).astype(np.int16)
+    return lambda: compute_mfcc(audio, 16000)
+
+def setup_batch_assembly():
+    from SyncNetInstance import video_tensor, lip_batch, mfcc_tensor, aud_batch
+    rng = _rng()
+    images = rng.randint(0, 256, (104, 224, 224, 3)).astype(np.uint8)
+    mfcc = rng.randn(13, 4 * 104 + 20)
+    def run():
+        imtv = video_tensor(images)
+        cct = mfcc_tensor(mfcc)
+        for i in range(0, 100, 20):
+            lip_batch(imtv, i, i + 20)
+            aud_batch(cct, i, i + 20)
+    return run
+
+def setup_track_shot():
+    from facetrack import track_shot
+    class Opt(object):
+        num_failed_det = 25
+        min_track = 100
+        min_face_size = 0
+    rng = _rng()
+    starts = _boxes(rng, 3)
+    scenefaces = []
+    for frame in range(1000):
+        boxes = starts + frame * 0.5 + rng.uniform(-2, 2, (3, 4))
+        scenefaces.append([{'frame': frame, 'bbox': box.tolist(), 'conf': 0.99} for box in boxes if rng.uniform() > 0.05])
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            track_shot(Opt(), scenefaces)
+    return run
+
+def setup_bb_intersection_over_union():
+    from facetrack import bb_intersection_over_union
+    rng = _rng()
+    pairs = list(zip(_boxes(rng, 10000).tolist(), _boxes(rng, 10000).tolist()))
+    return lambda: [bb_intersection_over_union(a, b) for a, b in pairs]
+
+def setup_forward_lip():
+    from SyncNetModel import S
+    torch.manual_seed(0)
+    model = S().eval()
+    x = torch.randn(2, 3, 5, 224, 224)
+    def run():
+        with torch.no_grad():
+            model.forward_lip(x)
+    return run
+
+def setup_forward_aud():
+    from SyncNetModel import S
+    torch.manual_seed(0)
+    model = S().eval()
+    x = torch.randn(20, 1, 13, 20)
+    def run():
+        with torch.no_grad():
+            model.forward_aud(x)
+    return run
+
+def setup_s3fdnet_forward():
+    from detectors.s3fd.nets import S3FDNet
+    torch.manual_seed(0)
+    net = S3FDNet(device='cpu').eval()
+    x = torch.randn(1, 3, 180, 320) * 50
+    def run():
+        with torch.no_grad():
+            net(x)
+    return run
+
+KERNELS = [
+    ('calc_pdist', setup_calc_pdist),
+    ('calc_pdist_wide', setup_calc_pdist_wide),
+    ('nms_', setup_nms_),
+    ('box_utils.nms', setup_box_utils_nms),
+    ('Detect.forward', setup_detect_forward),
+    ('PriorBox.forward', setup_priorbox_forward),
+    ('mfcc', setup_mfcc),
+    ('batch_assembly', setup_batch_assembly),
+    ('track_shot', setup_track_shot),
+    ('bb_intersection_over_union', setup_bb_intersection_over_union),
+    ('S.forward_lip', setup_forward_lip),
+    ('S.forward_aud', setup_forward_aud),
+    ('S3FDNet.forward', setup_s3fdnet_forward),
+]
+
+# ==================== RUNNER ====================
+
+def measure(fn, repeat=5):
+    """Best per-call time over `repeat` runs, each long enough (>= 0.2 s) to time reliably."""
+    fn()  # Warm-up
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def run_kernels(names, repeat=5):
+    results, skipped = {}, {}
+    for name, setup in KERNELS:
+        if names and name not in names:
+            continue
+        try:
+            fn = setup()
+        except ImportError as e:
+            skipped[name] = str(e)
+            continue
+        results[name] = measure(fn, repeat)
+    return results, skipped
+
+def compare(results, baseline, threshold):
+    """Names of kernels slower than baseline * (1 + threshold)."""
+    return [name for name, t in results.items() if name in baseline and t > baseline[name] * (1 + threshold)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the hot kernels on synthetic CPU inputs")
+    parser.add_argument('--baseline', type=str, default='benchmark_baseline.json', help='Baseline results file')
+    parser.add_argument('--update', action='store_true', help='Write the results of this run to the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown over the baseline, as a fraction')
+    parser.add_argument('--kernels', type=str, nargs='*', default=[], help='Only run these kernels')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per kernel; the best is kept')
+    parser.add_argument('--threads', type=int, default=1, help='Torch intra-op threads')
+    parser.add_argument('--strict', action='store_true', help='Fail when a kernel in the baseline is skipped')
+    opt = parser.parse_args()
+
+    torch.set_num_threads(opt.threads)
+
+    # Deprecation warnings raised inside the timed loops would dominate them
+    warnings.simplefilter('ignore')
+
+    baseline = {}
+    if os.path.exists(opt.baseline):
+        with open(opt.baseline) as fil:
+            baseline = json.load(fil)['kernels']
+    elif not opt.update:
+        # Nothing to compare against would otherwise pass every kernel
+        raise SystemExit('No baseline at %s; run with --update to write one.' % opt.baseline)
+
+    results, skipped = run_kernels(opt.kernels, opt.repeat)
+
+    for name, t in results.items():
+        ref = baseline.get(name)
+        change = '  %+6.1f%%' % ((t / ref - 1) * 100) if ref else ''
+        print('%-28s %10.3f ms%s' % (name, t * 1000, change))
+    for name, reason in skipped.items():
+        print('%-28s skipped (%s)' % (name, reason))
+
+    if opt.update:
+        baseline.update(results)
+        with open(opt.baseline, 'w') as fil:
+            json.dump({'kernels': baseline, 'machine': platform.platform(), 'python': platform.python_version(),
+                       'torch': torch.__version__, 'threads': opt.threads, 'time': time.time()}, fil, indent=2, sort_keys=True)
+        print('Baseline written to %s.' % opt.baseline)
+    else:
+        regressed = compare(results, baseline, opt.threshold)
+        # A kernel that could not run here was not checked against its baseline
+        unchecked = [name for name in skipped if name in baseline]
+        if unchecked:
+            print('WARNING: not checked against the baseline, skipped: %s' % ', '.join(unchecked))
+        if regressed:
+            raise SystemExit('Regressed past %.0f%%: %s' % (opt.threshold * 100, ', '.join(regressed)))
+        if unchecked and opt.strict:
+            raise SystemExit('Skipped with --strict: %s' % ', '.join(unchecked))
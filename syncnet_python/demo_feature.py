@@ -16,6 +16,7 @@ parser.add_argument('--vshift', type=int, default='15', help='');
 parser.add_argument('--videofile', type=str, default="data/example.avi", help='');
 parser.add_argument('--tmp_dir', type=str, default="data", help='');
 parser.add_argument('--save_as', type=str, default="data/features.pt", help='');
+parser.add_argument('--store_dir', type=str, default='', help='Embedding store directory; embeddings are reused when present');
 
 opt = parser.parse_args();
 
@@ -24,6 +25,9 @@ opt = parser.parse_args();
 
 s = SyncNetInstance();
 
+if opt.store_dir:
+    s.store = EmbeddingStore(opt.store_dir);
+
 s.loadParameters(opt.initial_model);
 print("Model %s loaded."%opt.initial_model);
 
@@ -16,6 +16,9 @@ parser.add_argument('--vshift', type=int, default='15', help='');
 parser.add_argument('--videofile', type=str, default="data/example.avi", help='');
 parser.add_argument('--tmp_dir', type=str, default="data/work/pytmp", help='');
 parser.add_argument('--reference', type=str, default="demo", help='');
+parser.add_argument('--store_dir', type=str, default='', help='Embedding store directory; embeddings are reused when present');
+parser.add_argument('--progressive', action='store_true', help='Stop embedding once the offset is stable and confident');
+parser.add_argument('--codec', type=str, default='', help='Embedding codec: float16, int8 or a .npz from embedding_codec.py');
 
 opt = parser.parse_args();
 
@@ -24,7 +27,16 @@ opt = parser.parse_args();
 
 s = SyncNetInstance();
 
+if opt.store_dir:
+    s.store = EmbeddingStore(opt.store_dir);
+
+if opt.codec:
+    s.codec = EmbeddingCodec.load(opt.codec);
+
 s.loadParameters(opt.initial_model);
 print("Model %s loaded."%opt.initial_model);
 
-s.evaluate(opt, videofile=opt.videofile)
+if opt.progressive:
+    s.evaluate_progressive(opt, videofile=opt.videofile)
+else:
+    s.evaluate(opt, videofile=opt.videofile)
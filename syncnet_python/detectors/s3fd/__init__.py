@@ -59,3 +59,44 @@ class S3FD():
             bboxes = bboxes[keep]
 
         return bboxes
+
+    def detect_faces_batch(self, images, conf_th=0.8, scales=[1]):
+        """Detect faces on a list of equally sized images with one forward pass per scale.
+
+        Returns one (N, 5) array of [x1, y1, x2, y2, score] per image, as detect_faces.
+        """
+
+        w, h = images[0].shape[1], images[0].shape[0]
+
+        bboxes = [[] for _ in images]
+
+        with torch.no_grad():
+            for s in scales:
+                batch = np.stack([cv2.resize(image, dsize=(0, 0), fx=s, fy=s, interpolation=cv2.INTER_LINEAR) for image in images])
+
+                # NHWC RGB -> NCHW, mean subtracted in BGR order as in detect_faces
+                batch = batch.transpose(0, 3, 1, 2).astype('float32')
+                batch -= img_mean[[2, 1, 0]]
+                x = torch.from_numpy(batch).to(self.device)
+                detections = self.net(x).cpu()
+
+                scale = torch.Tensor([w, h, w, h])
+
+                for b in range(detections.size(0)):
+                    for i in range(detections.size(1)):
+                        # Detections are sorted by score; keep the leading run above threshold
+                        above = (detections[b, i, :, 0] > conf_th).int()
+                        count = int(above.cumprod(0).sum())
+                        if count == 0:
+                            continue
+                        dets = detections[b, i, :count]
+                        pts = (dets[:, 1:] * scale).numpy()
+                        bboxes[b].append(np.hstack((pts, dets[:, :1].numpy())))
+
+        results = []
+        for boxes in bboxes:
+            boxes = np.vstack(boxes) if boxes else np.empty(shape=(0, 5))
+            keep = nms_(boxes, 0.1)
+            results.append(boxes[keep])
+
+        return results
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import argparse
+import numpy
+import torch
+
+# ==================== ENCODED FEATURES ====================
+
+class EncodedFeatures(object):
+    """A compressed (N, D) embedding sequence.
+
+    `data` is float16, int8 or float32. `scale` holds one float32 per row for
+    int8 data, and `sqnorm` holds the squared norm of every decoded row, so
+    distances never need the decoded vectors. Slicing returns rows, like a tensor.
+    """
+
+    def __init__(self, data, scale=None, sqnorm=None):
+        self.data = data
+        self.scale = scale
+        if sqnorm is None:
+            decoded = self.decode_rows(0, len(data))
+            sqnorm = (decoded**2).sum(1).numpy()
+        self.sqnorm = sqnorm
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        return EncodedFeatures(self.data[idx], None if self.scale is None else self.scale[idx], self.sqnorm[idx])
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+    def rows(self, lo, hi):
+        """float32 values of rows [lo, hi), without the int8 scale."""
+        return torch.from_numpy(numpy.asarray(self.data[lo:hi], dtype=numpy.float32))
+
+    def decode_rows(self, lo, hi):
+        rows = self.rows(lo, hi)
+        if self.scale is not None:
+            rows = rows * torch.from_numpy(numpy.asarray(self.scale[lo:hi], dtype=numpy.float32))[:, None]
+        return rows
+
+    def decode(self):
+        return self.decode_rows(0, len(self))
+
+# ==================== CODEC ====================
+
+class EmbeddingCodec(object):
+    """Optional PCA projection followed by float16 or int8 scalar quantization.
+
+    Lip and audio embeddings live in one joint space, so a single projection,
+    fitted on a sample of both, is applied to each. Distances between encoded
+    sequences equal distances between their decoded (projected) vectors.
+    """
+
+    def __init__(self, dtype='float16', mean=None, components=None):
+        assert dtype in ('float32', 'float16', 'int8')
+        self.dtype = dtype
+        self.mean = mean
+        self.components = components
+
+    @property
+    def name(self):
+        pca = 'pca%d-' % len(self.components) if self.components is not None else ''
+        return pca + self.dtype
+
+    def fit(self, sample, dim):
+        """Fit a dim-dimensional PCA projection to an (N, D) sample."""
+        sample = numpy.asarray(sample, dtype=numpy.float64)
+        self.mean = sample.mean(0).astype(numpy.float32)
+        _, _, vt = numpy.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = vt[:dim].astype(numpy.float32)
+        return self
+
+    def explained_variance(self, sample):
+        sample = numpy.asarray(sample, dtype=numpy.float32) - self.mean
+        return ((sample.dot(self.components.T))**2).sum() / (sample**2).sum()
+
+    def encode(self, feat):
+        feat = feat.numpy() if torch.is_tensor(feat) else numpy.asarray(feat)
+        feat = feat.astype(numpy.float32)
+        if self.components is not None:
+            feat = (feat - self.mean).dot(self.components.T)
+        if self.dtype == 'int8':
+            scale = numpy.abs(feat).max(1) / 127.
+            scale[scale == 0] = 1.
+            data = numpy.round(feat / scale[:, None]).astype(numpy.int8)
+            return EncodedFeatures(data, scale.astype(numpy.float32))
+        return EncodedFeatures(feat.astype(self.dtype))
+
+    def save(self, path):
+        numpy.savez(path, dtype=self.dtype, mean=self.mean if self.mean is not None else numpy.zeros(0),
+                    components=self.components if self.components is not None else numpy.zeros((0, 0)))
+
+    @classmethod
+    def load(cls, spec):
+        """A codec from a saved .npz file, or a plain 'float16' / 'int8' without PCA."""
+        if spec in ('float32', 'float16', 'int8'):
+            return cls(spec)
+        data = numpy.load(spec)
+        components = data['components'] if data['components'].size else None
+        return cls(str(data['dtype']), data['mean'] if components is not None else None, components)
+
+# ==================== DISTANCES ====================
+
+def calc_pdist_encoded(feat1, feat2, vshift=10, block_size=256):
+    """calc_pdist_wide on EncodedFeatures: an (N, 2*vshift+1) distance tensor.
+
+    |a-b|^2 = |a|^2 + |b|^2 - 2 s_a <q_a, b> with the stored norms, so the
+    rows of feat1 enter the GEMM of each block as their raw int8 / float16
+    values and only the band of products is rescaled.
+    """
+    win_size = vshift*2+1
+    n = len(feat1)
+
+    # Rows of feat2 at every padded position; padding rows are zero with zero norm
+    pos = torch.arange(-vshift, len(feat2) + vshift)
+    valid = (pos >= 0) & (pos < len(feat2))
+
+    sq1 = torch.from_numpy(numpy.asarray(feat1.sqnorm, dtype=numpy.float32))
+    sq2 = torch.zeros(len(pos))
+    sq2[valid] = torch.from_numpy(numpy.asarray(feat2.sqnorm, dtype=numpy.float32))
+
+    dists = []
+
+    for i in range(0, n, block_size):
+
+        m = min(block_size, n - i)
+        a = feat1.decode_rows(i, i+m) if feat1.scale is None else feat1.rows(i, i+m)
+
+        lo = i - vshift
+        hi = i + m + vshift
+        b = torch.zeros(hi - lo, a.shape[1])
+        blo, bhi = max(lo, 0), min(hi, len(feat2))
+        if bhi > blo:
+            b[blo-lo:bhi-lo] = feat2.rows(blo, bhi)
+            if feat2.scale is not None:
+                b[blo-lo:bhi-lo] *= torch.from_numpy(numpy.asarray(feat2.scale[blo:bhi], dtype=numpy.float32))[:, None]
+
+        # Row r of the band holds the dot products of a[r] with b[r:r+win_size]
+        idx = torch.arange(m).unsqueeze(1) + torch.arange(win_size).unsqueeze(0)
+        band = torch.mm(a, b.t()).gather(1, idx)
+        if feat1.scale is not None:
+            band = band * torch.from_numpy(numpy.asarray(feat1.scale[i:i+m], dtype=numpy.float32))[:, None]
+
+        d2 = sq1[i:i+m].unsqueeze(1) + sq2[i+idx] - 2*band
+        dists.append(d2.clamp(min=0).sqrt())
+
+    return torch.cat(dists,0)
+
+# ==================== AGREEMENT REPORT ====================
+
+def offset_from_dists(dists, vshift):
+    mdist = dists.mean(0)
+    minval, minidx = torch.min(mdist, 0)
+    return vshift - int(minidx), float(torch.median(mdist) - minval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit an embedding codec and report agreement with full precision")
+    parser.add_argument('--store_dir', type=str, required=True, help='EmbeddingStore with lip and aud embeddings')
+    parser.add_argument('--dtype', type=str, default='int8', choices=['float32', 'float16', 'int8'], help='')
+    parser.add_argument('--pca_dim', type=int, default=0, help='PCA output dimensions (0 for no projection)')
+    parser.add_argument('--sample_size', type=int, default=50000, help='Rows of lip and audio embeddings to fit PCA on')
+    parser.add_argument('--vshift', type=int, default=15, help='')
+    parser.add_argument('--save', type=str, default='', help='Write the fitted codec to this .npz file')
+    opt = parser.parse_args()
+
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore(opt.store_dir)
+    keys = [key for key in sorted(store.index) if store.has(key, 'lip', 'aud')]
+
+    codec = EmbeddingCodec(opt.dtype)
+    if opt.pca_dim:
+        rng = numpy.random.RandomState(0)
+        sample = numpy.concatenate([numpy.asarray(store.get(key, kind)) for key in keys for kind in ('lip', 'aud')])
+        sample = sample[rng.choice(len(sample), min(len(sample), opt.sample_size), replace=False)]
+        codec.fit(sample, opt.pca_dim)
+        print('PCA to %d dims keeps %.2f%% of the variance.' % (opt.pca_dim, 100 * codec.explained_variance(sample)))
+    if opt.save:
+        codec.save(opt.save)
+
+    from SyncNetInstance import calc_pdist_wide
+    agree, conf_diffs, full_bytes, enc_bytes = 0, [], 0, 0
+    for key in keys:
+        im_feat = torch.from_numpy(numpy.array(store.get(key, 'lip')))
+        cc_feat = torch.from_numpy(numpy.array(store.get(key, 'aud')))
+        offset, conf = offset_from_dists(calc_pdist_wide(im_feat, cc_feat, vshift=opt.vshift), opt.vshift)
+
+        im_enc, cc_enc = codec.encode(im_feat), codec.encode(cc_feat)
+        offset_c, conf_c = offset_from_dists(calc_pdist_encoded(im_enc, cc_enc, vshift=opt.vshift), opt.vshift)
+
+        agree += offset == offset_c
+        conf_diffs.append(abs(conf - conf_c) / max(abs(conf), 1e-6))
+        full_bytes += im_feat.numpy().nbytes + cc_feat.numpy().nbytes
+        enc_bytes += im_enc.nbytes + cc_enc.nbytes
+
+    print('Codec %s on %d files: %.1fx smaller' % (codec.name, len(keys), full_bytes / float(max(enc_bytes, 1))))
+    print('Offset agreement: \t%d/%d' % (agree, len(keys)))
+    if conf_diffs:
+        print('Confidence rel. error: \tmean %.4f, max %.4f' % (numpy.mean(conf_diffs), numpy.max(conf_diffs)))
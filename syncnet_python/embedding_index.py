@@ -0,0 +1,269 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import argparse
+import numpy
+
+# ==================== K-MEANS ====================
+
+def sq_dists(x, c):
+    """Squared L2 distances between the rows of x (N, D) and c (K, D)."""
+    d = (x**2).sum(1)[:, None] - 2 * x.dot(c.T) + (c**2).sum(1)[None, :]
+    return numpy.maximum(d, 0)
+
+def kmeans(x, k, iters=20, seed=0, batch_size=65536):
+    """Lloyd's k-means with assignments computed batch by batch from one GEMM each."""
+    rng = numpy.random.RandomState(seed)
+    x = numpy.asarray(x, dtype=numpy.float32)
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].copy()
+    for _ in range(iters):
+        assign = assign_nearest(x, centroids, batch_size)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, assign, x)
+        counts = numpy.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Restart empty clusters on random points
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+def assign_nearest(x, centroids, batch_size=65536):
+    return numpy.concatenate([sq_dists(x[i:i+batch_size], centroids).argmin(1) for i in range(0, len(x), batch_size)])
+
+# ==================== IVF-PQ INDEX ====================
+
+class IVFPQIndex(object):
+    """Inverted-file index with product-quantized residuals, for L2 search over
+    lip or audio embeddings.
+
+    Vectors are assigned to one of nlist coarse centroids. The residual to that
+    centroid is split into m sub-vectors, each stored as one byte indexing a
+    256-entry codebook. A search scans the nprobe nearest lists of every query
+    with table lookups only. Queries are grouped by list, so every probed list
+    is scanned once per batch of queries.
+
+    Codes are appended with `add` and kept grouped by list lazily. `save` writes
+    flat .npy files that `load` maps back without reading them into memory.
+    """
+
+    def __init__(self, dim, nlist=256, m=16, seed=0):
+        assert dim % m == 0, 'dim must be divisible by m'
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.seed = seed
+        self.centroids = None
+        self.codebooks = None
+        self.codes = numpy.zeros((0, m), dtype=numpy.uint8)
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.lists = numpy.zeros(0, dtype=numpy.int32)
+        self.bias = numpy.zeros(0, dtype=numpy.float32)
+        self._offsets = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, x, iters=20):
+        x = numpy.asarray(x, dtype=numpy.float32)
+        self.centroids = kmeans(x, self.nlist, iters, self.seed)
+        residuals = x - self.centroids[assign_nearest(x, self.centroids)]
+        self.codebooks = numpy.stack([kmeans(residuals[:, j*self.dsub:(j+1)*self.dsub], 256, iters, self.seed + j)
+                                      for j in range(self.m)])
+
+    def _encode(self, residuals):
+        return numpy.stack([assign_nearest(residuals[:, j*self.dsub:(j+1)*self.dsub], self.codebooks[j])
+                            for j in range(self.m)], 1).astype(numpy.uint8)
+
+    def add(self, x, ids=None):
+        x = numpy.asarray(x, dtype=numpy.float32)
+        if ids is None:
+            ids = numpy.arange(len(self.ids), len(self.ids) + len(x))
+        lists = assign_nearest(x, self.centroids).astype(numpy.int32)
+        codes = self._encode(x - self.centroids[lists])
+
+        # |c + y|^2 - |c|^2 = sum_j (|y_j|^2 + 2 <c_j, y_j>), the query-independent part of the distance
+        y = self.codebooks[numpy.arange(self.m), codes]                      # (N, m, dsub)
+        c = self.centroids[lists].reshape(len(x), self.m, self.dsub)
+        bias = ((y**2).sum(2) + 2 * (c * y).sum(2)).sum(1).astype(numpy.float32)
+
+        self.codes = numpy.concatenate([self.codes, codes])
+        self.ids = numpy.concatenate([self.ids, numpy.asarray(ids, dtype=numpy.int64)])
+        self.lists = numpy.concatenate([self.lists, lists])
+        self.bias = numpy.concatenate([self.bias, bias])
+        self._offsets = None
+
+    def _group(self):
+        """Sort entries by list (stable, so ids keep insertion order) and build list offsets."""
+        if self._offsets is None:
+            order = numpy.argsort(self.lists, kind='stable')
+            if numpy.any(order != numpy.arange(len(order))):
+                self.codes, self.ids, self.lists, self.bias = self.codes[order], self.ids[order], self.lists[order], self.bias[order]
+            self._offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(self.lists, minlength=self.nlist))])
+        return self._offsets
+
+    def search(self, queries, k=10, nprobe=8):
+        """Approximate k nearest neighbours. Returns (squared distances, ids), both (Q, k);
+        missing neighbours have distance inf and id -1."""
+        queries = numpy.asarray(queries, dtype=numpy.float32)
+        offsets = self._group()
+        nq = len(queries)
+        nprobe = min(nprobe, self.nlist)
+
+        coarse = sq_dists(queries, self.centroids)
+        probes = numpy.argpartition(coarse, nprobe - 1, 1)[:, :nprobe] if nprobe < self.nlist else numpy.tile(numpy.arange(self.nlist), (nq, 1))
+
+        # -2 <q_j, y> for every query, subspace and code: (Q, m, 256)
+        tables = -2 * numpy.einsum('qjd,jcd->qjc', queries.reshape(nq, self.m, self.dsub), self.codebooks)
+
+        cand_d = numpy.full((nq, nprobe * k), numpy.inf, dtype=numpy.float32)
+        cand_i = numpy.full((nq, nprobe * k), -1, dtype=numpy.int64)
+
+        qs, ranks = numpy.nonzero(numpy.ones_like(probes, dtype=bool))
+        lists = probes[qs, ranks]
+        order = numpy.argsort(lists, kind='stable')
+        qs, ranks, lists = qs[order], ranks[order], lists[order]
+        bounds = numpy.flatnonzero(numpy.diff(lists)) + 1
+
+        for group in numpy.split(numpy.arange(len(lists)), bounds):
+            if len(group) == 0:
+                continue
+            lst = lists[group[0]]
+            lo, hi = offsets[lst], offsets[lst + 1]
+            if hi == lo:
+                continue
+            gq, gr = qs[group], ranks[group]
+            codes = self.codes[lo:hi]
+
+            # |q - c - y|^2 = |q - c|^2 + bias - 2 <q, y>, for all (query, entry) pairs of this list
+            dist = coarse[gq, lst][:, None] + self.bias[lo:hi][None, :]
+            for j in range(self.m):
+                dist += tables[gq, j][:, codes[:, j]]
+
+            kk = min(k, hi - lo)
+            top = numpy.argpartition(dist, kk - 1, 1)[:, :kk] if kk < hi - lo else numpy.tile(numpy.arange(hi - lo), (len(gq), 1))
+            cols = gr[:, None] * k + numpy.arange(kk)[None, :]
+            cand_d[gq[:, None], cols] = numpy.take_along_axis(dist, top, 1)
+            cand_i[gq[:, None], cols] = self.ids[lo:hi][top]
+
+        best = numpy.argsort(cand_d, 1, kind='stable')[:, :k]
+        return numpy.take_along_axis(cand_d, best, 1), numpy.take_along_axis(cand_i, best, 1)
+
+    def save(self, path):
+        self._group()
+        os.makedirs(path, exist_ok=True)
+        for name in ['centroids', 'codebooks', 'codes', 'ids', 'lists', 'bias']:
+            numpy.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as fil:
+            json.dump({'dim': self.dim, 'nlist': self.nlist, 'm': self.m, 'seed': self.seed}, fil)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as fil:
+            meta = json.load(fil)
+        index = cls(meta['dim'], meta['nlist'], meta['m'], meta['seed'])
+        for name in ['centroids', 'codebooks', 'codes', 'ids', 'lists', 'bias']:
+            setattr(index, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None))
+        # Saved grouped by list, so the offsets can be rebuilt without touching the codes
+        index._offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(index.lists, minlength=index.nlist))])
+        return index
+
+# ==================== BRUTE FORCE ====================
+
+def brute_force_search(database, queries, k=10, batch_size=1024):
+    """Exact k nearest neighbours by squared L2, one GEMM per batch of queries."""
+    database = numpy.asarray(database, dtype=numpy.float32)
+    dists, ids = [], []
+    for i in range(0, len(queries), batch_size):
+        d = sq_dists(numpy.asarray(queries[i:i+batch_size], dtype=numpy.float32), database)
+        top = numpy.argpartition(d, k - 1, 1)[:, :k]
+        top = numpy.take_along_axis(top, numpy.argsort(numpy.take_along_axis(d, top, 1), 1), 1)
+        dists.append(numpy.take_along_axis(d, top, 1))
+        ids.append(top)
+    return numpy.concatenate(dists), numpy.concatenate(ids)
+
+# ==================== EMBEDDING STORE ====================
+
+def add_store_embeddings(index, store, kind='lip'):
+    """Add every `kind` array of an EmbeddingStore to the index.
+
+    Ids are consecutive over the store's keys; the returned [key, first_id, rows]
+    spans map a hit back to its file and window.
+    """
+    spans = []
+    for key in sorted(store.index):
+        if kind not in store.index[key]:
+            continue
+        x = numpy.asarray(store.get(key, kind))
+        first = len(index)
+        index.add(x, numpy.arange(first, first + len(x)))
+        spans.append([key, first, len(x)])
+    return spans
+
+# ==================== BENCHMARK ====================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recall vs latency of IVFPQIndex against brute force")
+    parser.add_argument('--store_dir', type=str, default='', help='Index embeddings from this EmbeddingStore (default: synthetic data)')
+    parser.add_argument('--kind', type=str, default='lip', help='Embedding kind to index from the store')
+    parser.add_argument('--num_vectors', type=int, default=200000, help='Synthetic database size')
+    parser.add_argument('--dim', type=int, default=1024, help='Synthetic embedding size')
+    parser.add_argument('--num_queries', type=int, default=1000, help='')
+    parser.add_argument('--nlist', type=int, default=1024, help='')
+    parser.add_argument('--m', type=int, default=64, help='PQ sub-vectors')
+    parser.add_argument('--k', type=int, default=10, help='')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64], help='')
+    parser.add_argument('--save_dir', type=str, default='', help='Save the index here and benchmark the memory-mapped copy')
+    opt = parser.parse_args()
+
+    rng = numpy.random.RandomState(0)
+    if opt.store_dir:
+        from embedding_store import EmbeddingStore
+        store = EmbeddingStore(opt.store_dir)
+        data = numpy.concatenate([numpy.asarray(store.get(key, opt.kind)) for key in sorted(store.index) if opt.kind in store.index[key]])
+    else:
+        # Clustered data, closer to real embeddings than i.i.d. noise
+        centers = rng.randn(opt.nlist * 4, opt.dim).astype(numpy.float32)
+        data = centers[rng.randint(len(centers), size=opt.num_vectors)] + 0.5 * rng.randn(opt.num_vectors, opt.dim).astype(numpy.float32)
+
+    # Queries are perturbed copies of database entries, as when looking up the
+    # same content re-encoded or dubbed
+    database = data
+    queries = database[rng.choice(len(database), opt.num_queries, replace=False)]
+    queries = queries + 0.1 * queries.std() * rng.randn(*queries.shape).astype(numpy.float32)
+    print('Database %d x %d, %d queries' % (database.shape + (len(queries),)))
+
+    tS = time.time()
+    index = IVFPQIndex(database.shape[1], nlist=opt.nlist, m=opt.m)
+    index.train(database[rng.choice(len(database), min(len(database), 50 * opt.nlist), replace=False)])
+    print('Trained in %.1f sec.' % (time.time() - tS))
+    tS = time.time()
+    for i in range(0, len(database), 100000):
+        index.add(database[i:i+100000], numpy.arange(i, min(i + 100000, len(database))))
+    print('Added in %.1f sec.' % (time.time() - tS))
+
+    if opt.save_dir:
+        index.save(opt.save_dir)
+        index = IVFPQIndex.load(opt.save_dir)
+
+    tS = time.time()
+    _, truth = brute_force_search(database, queries, opt.k)
+    t_brute = (time.time() - tS) / len(queries)
+    print('brute force          %8.3f ms/query' % (t_brute * 1000))
+
+    for nprobe in opt.nprobe:
+        index.search(queries[:10], opt.k, nprobe)
+        tS = time.time()
+        _, ids = index.search(queries, opt.k, nprobe)
+        t = (time.time() - tS) / len(queries)
+        recall1 = numpy.mean([truth[q, 0] in ids[q] for q in range(len(queries))])
+        recallk = numpy.mean([len(numpy.intersect1d(truth[q], ids[q])) / float(opt.k) for q in range(len(queries))])
+        print('nprobe %4d  %8.3f ms/query  1-recall@%d %.3f  %d-recall@%d %.3f  %.1fx'
+              % (nprobe, t * 1000, opt.k, recall1, opt.k, opt.k, recallk, t_brute / t))
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import numpy
+
+# ==================== HASHING ====================
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA1 of a file's content, read in chunks."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as fil:
+        for chunk in iter(lambda: fil.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ==================== EMBEDDING STORE ====================
+
+class EmbeddingStore(object):
+    """Persistent store of per-file embeddings backed by appendable raw arrays.
+
+    Each kind of array ('lip', 'aud', 'lipfeat', 'mfcc', ...) of a given width
+    and dtype lives in one flat file that only ever grows; `get` returns
+    read-only np.memmap views into it. index.json maps a key, built from the
+    input's content hash, the model version and the window parameters, to the
+    row range of every array stored for that key.
+
+    Arrays are appended before the index is rewritten (atomically), so a crash
+    can leave unreferenced rows behind but never a dangling index entry.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index = {}
+        if os.path.exists(os.path.join(root, self.INDEX)):
+            with open(os.path.join(root, self.INDEX)) as fil:
+                self.index = json.load(fil)
+
+    @staticmethod
+    def key(content_hash, model_version, **params):
+        params = ','.join('%s=%s' % (k, params[k]) for k in sorted(params))
+        return '%s:%s:%s' % (content_hash, model_version, params)
+
+    def _path(self, kind, width, dtype):
+        return os.path.join(self.root, '%s_%d.%s' % (kind, width, numpy.dtype(dtype).name))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def has(self, key, *kinds):
+        return key in self.index and all(kind in self.index[key] for kind in kinds)
+
+    def get(self, key, kind):
+        offset, rows, width, dtype = self.index[key][kind]
+        dtype = numpy.dtype(dtype)
+        if rows == 0:
+            return numpy.zeros((0, width), dtype=dtype)
+        return numpy.memmap(self._path(kind, width, dtype), dtype=dtype, mode='r',
+                            offset=offset * width * dtype.itemsize, shape=(rows, width))
+
+    def put(self, key, **arrays):
+        entry = dict(self.index.get(key, {}))
+
+        for kind, array in arrays.items():
+            array = numpy.ascontiguousarray(array)
+            array = array.reshape(len(array), -1)
+            rows, width = array.shape
+            path = self._path(kind, width, array.dtype)
+
+            with open(path, 'ab') as fil:
+                offset = fil.tell() // (width * array.dtype.itemsize)
+                fil.write(array.tobytes())
+                fil.flush()
+                os.fsync(fil.fileno())
+
+            entry[kind] = [offset, rows, width, array.dtype.name]
+
+        self.index[key] = entry
+        self._write_index()
+
+    def _write_index(self):
+        tmp = os.path.join(self.root, self.INDEX + '.tmp')
+        with open(tmp, 'w') as fil:
+            json.dump(self.index, fil)
+            fil.flush()
+            os.fsync(fil.fileno())
+        os.replace(tmp, os.path.join(self.root, self.INDEX))
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import time, argparse
+
+import torch
+
+from SyncNetModel import *
+from embedding_store import file_hash
+
+# ==================== LOAD PARAMS ====================
+
+
+parser = argparse.ArgumentParser(description = "Export SyncNet towers as frozen TorchScript with BatchNorm folded");
+
+parser.add_argument('--initial_model', type=str, default="data/syncnet_v2.model", help='');
+parser.add_argument('--output_dir', type=str, default="data/syncnet_v2_frozen", help='Directory for lip.pt, lipfeat.pt and aud.pt');
+parser.add_argument('--device', type=str, default='cuda', help='');
+parser.add_argument('--batch_size', type=int, default='20', help='Batch size for the check and the benchmark');
+parser.add_argument('--tolerance', type=float, default='1e-4', help='Maximum absolute difference allowed, relative to the output scale');
+parser.add_argument('--iters', type=int, default='10', help='Timed iterations per tower');
+
+opt = parser.parse_args();
+
+
+# ==================== EXPORT ====================
+
+model = S();
+loaded_state = torch.load(opt.initial_model, map_location=lambda storage, loc: storage);
+self_state = model.state_dict();
+for name, param in loaded_state.items():
+    self_state[name].copy_(param);
+model = model.to(opt.device).eval();
+
+frozen = export_towers(model, opt.output_dir, device=opt.device, model_version=file_hash(opt.initial_model)[:16]);
+print("Towers exported to %s."%opt.output_dir);
+
+reference = {'lip': model.forward_lip, 'lipfeat': model.forward_lipfeat, 'aud': model.forward_aud};
+
+# ==================== CHECK AND BENCHMARK ====================
+
+def timed(fn, x, iters):
+    with torch.no_grad():
+        fn(x)
+        if opt.device.startswith('cuda'):
+            torch.cuda.synchronize()
+        tS = time.time()
+        for _ in range(iters):
+            fn(x)
+        if opt.device.startswith('cuda'):
+            torch.cuda.synchronize()
+    return (time.time()-tS) / iters
+
+failed = []
+
+for name, tower in frozen.items():
+
+    x = torch.randn((opt.batch_size,) + TOWER_INPUTS[name], device=opt.device) * 64 + 128
+
+    with torch.no_grad():
+        ref = reference[name](x)
+        out = tower(x)
+
+    err = (out - ref).abs().max().item() / max(ref.abs().max().item(), 1e-12)
+    if err > opt.tolerance:
+        failed.append(name)
+
+    t_ref = timed(reference[name], x, opt.iters)
+    t_out = timed(tower, x, opt.iters)
+
+    print('%-8s max rel err %.2e  eager %.2f ms  frozen %.2f ms  speedup %.2fx'%(name, err, t_ref*1000, t_out*1000, t_ref/t_out));
+
+if failed:
+    raise SystemExit('Towers outside tolerance: %s'%', '.join(failed))
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+
+import os
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.interpolate import interp1d
+from scipy import signal
+from scipy.io import wavfile
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from frame_bus import FrameBus, TrackVideoConsumer, TrackArrayConsumer
+from frame_store import frame_source
+from SyncNetInstance import active_speaker_matrix, compute_mfcc
+
+# ========== ========== ========== ==========
+# # FACE TRACK
+# ========== ========== ========== ==========
+
+class Track(object):
+    """Face track stored as preallocated NumPy arrays of frame numbers and boxes.
+
+    `track['frame']` and `track['bbox']` return the filled part of the arrays, so
+    code written for the old `{'frame': [...], 'bbox': [...]}` dicts keeps working.
+    """
+
+    __slots__ = ('_frame', '_bbox', '_len')
+
+    def __init__(self, frame=None, bbox=None, capacity=64):
+        self._frame = np.empty(capacity, dtype=np.int32)
+        self._bbox = np.empty((capacity, 4), dtype=np.float32)
+        self._len = 0
+        if frame is not None:
+            self.append(frame, bbox)
+
+    @classmethod
+    def from_arrays(cls, frame, bbox):
+        track = cls(capacity=max(len(frame), 1))
+        track._frame[:len(frame)] = frame
+        track._bbox[:len(frame)] = bbox
+        track._len = len(frame)
+        return track
+
+    def append(self, frame, bbox):
+        if self._len == len(self._frame):
+            self._frame = np.resize(self._frame, 2 * self._len)
+            self._bbox = np.resize(self._bbox, (2 * self._len, 4))
+        self._frame[self._len] = frame
+        self._bbox[self._len] = bbox
+        self._len += 1
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def frame(self):
+        return self._frame[:self._len]
+
+    @property
+    def bbox(self):
+        return self._bbox[:self._len]
+
+    def __getitem__(self, key):
+        if key == 'frame':
+            return self.frame
+        if key == 'bbox':
+            return self.bbox
+        raise KeyError(key)
+
+    def __getstate__(self):
+        # Drop the unused preallocated tail from pickles
+        return (self.frame.copy(), self.bbox.copy())
+
+    def __setstate__(self, state):
+        self._frame, self._bbox = state
+        self._len = len(self._frame)
+
+    def interpolate(self):
+        """Return a track covering every frame from first to last, filling missed
+        detections by linear interpolation of all four box coordinates at once."""
+        if self._len < 2 or self.frame[-1] - self.frame[0] + 1 == self._len:
+            return Track.from_arrays(self.frame, self.bbox)
+        frame_i = np.arange(self.frame[0], self.frame[-1] + 1)
+        bbox_i = interp1d(self.frame, self.bbox, axis=0)(frame_i)
+        return Track.from_arrays(frame_i, bbox_i)
+
+    def smooth(self, kernel_size=13):
+        """Median-filtered box centre (x, y) and half size (s) for every frame.
+
+        The kernel is cut to the largest odd size within the track, as medfilt
+        zero-pads and would otherwise return zeros for short tracks.
+        """
+        kernel_size = max(1, min(kernel_size, self._len - 1 + self._len % 2))
+        bbox = self.bbox.astype(np.float64)
+        s = np.maximum(bbox[:, 3] - bbox[:, 1], bbox[:, 2] - bbox[:, 0]) / 2
+        y = (bbox[:, 1] + bbox[:, 3]) / 2
+        x = (bbox[:, 0] + bbox[:, 2]) / 2
+        return {'s': signal.medfilt(s, kernel_size=kernel_size),
+                'x': signal.medfilt(x, kernel_size=kernel_size),
+                'y': signal.medfilt(y, kernel_size=kernel_size)}
+
+# ========== ========== ========== ==========
+# # FACE TRACKING
+# ========== ========== ========== ==========
+
+def iou_matrix(boxesA, boxesB):
+    """Pairwise IoU between (N, 4) and (M, 4) boxes, same convention as bb_intersection_over_union."""
+    a = np.asarray(boxesA, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxesB, dtype=np.float64).reshape(-1, 4)[None, :, :]
+
+    interW = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]) + 1)
+    interH = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]) + 1)
+    interArea = interW * interH
+
+    boxAArea = (a[..., 2] - a[..., 0] + 1) * (a[..., 3] - a[..., 1] + 1)
+    boxBArea = (b[..., 2] - b[..., 0] + 1) * (b[..., 3] - b[..., 1] + 1)
+
+    return interArea / (boxAArea + boxBArea - interArea)
+
+def track_shot(opt, scenefaces):
+    print("Starting face tracking...")
+    iouThres = 0.5
+    tracks = []
+    live = []  # indices of tracks that may still be extended
+
+    for framefaces in scenefaces:
+        if not framefaces:
+            continue
+        frame_num = framefaces[0]['frame']
+
+        # Retire tracks that have gone more than num_failed_det frames without a detection
+        live = [t for t in live if frame_num - tracks[t].frame[-1] <= opt.num_failed_det]
+
+        matched = np.zeros(len(framefaces), dtype=bool)
+        if live:
+            ious = iou_matrix(np.stack([tracks[t].bbox[-1] for t in live]), [face['bbox'] for face in framefaces])
+            rows, cols = linear_sum_assignment(-ious)
+            keep = ious[rows, cols] > iouThres
+            for r, c in zip(rows[keep], cols[keep]):
+                tracks[live[r]].append(framefaces[c]['frame'], framefaces[c]['bbox'])
+            matched[cols[keep]] = True
+
+        for c in np.flatnonzero(~matched):
+            live.append(len(tracks))
+            tracks.append(Track(framefaces[c]['frame'], framefaces[c]['bbox']))
+
+    # Too short or too small to be a speaker, as in the original pipeline
+    tracks = [track.interpolate() for track in tracks if len(track) > opt.min_track]
+    tracks = [track for track in tracks
+              if max(np.mean(track.bbox[:, 2] - track.bbox[:, 0]), np.mean(track.bbox[:, 3] - track.bbox[:, 1])) > opt.min_face_size]
+
+    print(f"Completed tracking with {len(tracks)} tracks found.")
+    return tracks
+
+def bb_intersection_over_union(boxA, boxB):
+    # Unpack the bounding box coordinates
+    xA = max(boxA[0], boxB[0])
+    yA = max(boxA[1], boxB[1])
+    xB = min(boxA[2], boxB[2])
+    yB = min(boxA[3], boxB[3])
+
+    # Compute the area of intersection rectangle
+    interArea = max(0, xB - xA + 1) * max(0, yB - yA + 1)
+
+    # Compute the area of both the prediction and ground-truth rectangles
+    boxAArea = (boxA[2] - boxA[0] + 1) * (boxA[3] - boxA[1] + 1)
+    boxBArea = (boxB[2] - boxB[0] + 1) * (boxB[3] - boxB[1] + 1)
+
+    # Compute the intersection over union by dividing the intersection area by the sum of
+    # the prediction + ground-truth areas - the intersection area
+    iou = interArea / float(boxAArea + boxBArea - interArea)
+
+    return iou
+
+# ========== ========== ========== ==========
+# # FACE TRACK CROPPING
+# ========== ========== ========== ==========
+
+def crop_tracks(opt, tracks, output_files=None, start=0, end=None):
+    """Crop all tracks into encoded videos with audio in one pass over [start, end)."""
+    if output_files is None:
+        output_files = [os.path.join(opt.crop_dir, opt.reference, f'{ii:05d}.avi') for ii in range(len(tracks))]
+    if not tracks:
+        return tracks
+
+    os.makedirs(os.path.dirname(output_files[0]), exist_ok=True)
+
+    bus = FrameBus(frame_source(opt), start=start, end=end)
+    bus.register(TrackVideoConsumer(tracks, output_files, os.path.join(opt.avi_dir, opt.reference, 'audio.wav'),
+                                    frame_rate=opt.frame_rate, crop_scale=opt.crop_scale))
+    bus.run()
+
+    return tracks
+
+# ========== ========== ========== ==========
+# # SHOT-PARALLEL TRACKING AND CROPPING
+# ========== ========== ========== ==========
+
+def group_shots(shots, num_groups):
+    """Split shots into min(num_groups, len(shots)) contiguous groups of similar frame count.
+
+    A group is closed once the frames before the next shot reach its share of
+    the total, or when the shots left are only enough to give every remaining
+    group one.
+    """
+    if not shots:
+        return []
+    num_groups = min(max(num_groups, 1), len(shots))
+    total = sum(end - start for start, end in shots)
+
+    groups = [[shots[0]]]
+    length = shots[0][1] - shots[0][0]
+    for idx, shot in enumerate(shots[1:], 1):
+        groups_left = num_groups - len(groups)
+        if groups_left > 0 and (length >= total * len(groups) / float(num_groups) or len(shots) - idx == groups_left):
+            groups.append([])
+        groups[-1].append(shot)
+        length += shot[1] - shot[0]
+    return groups
+
+def track_and_crop_group(opt, shots, faces, first_frame):
+    """Worker entry point: track every shot of a group, then crop all of its tracks
+    in one sequential pass over the group's frame range.
+
+    Crops go to temporary `_part` files; the parent renames them once the
+    global track numbering is known.
+    """
+    tracks = []
+    for start, end in shots:
+        tracks.extend(track_shot(opt, faces[start - first_frame:end - first_frame]))
+    tracks = [{'track': track, 'proc_track': track.smooth()} for track in tracks]
+
+    output_files = [os.path.join(opt.crop_dir, opt.reference, f'_part{first_frame:06d}_{k:05d}.avi') for k in range(len(tracks))]
+    crop_tracks(opt, tracks, output_files, start=shots[0][0], end=shots[-1][1])
+
+    return tracks, output_files
+
+def track_and_crop_parallel(opt, faces, scene):
+    shots = [shot for shot in scene if shot[1] - shot[0] >= opt.min_track]
+    groups = group_shots(shots, opt.workers * 4)
+    print(f"Tracking and cropping {len(shots)} shots in {len(groups)} groups on {opt.workers} workers...")
+
+    # fork, so that workers do not re-import the calling script as __main__
+    executor = ProcessPoolExecutor(max_workers=opt.workers, mp_context=multiprocessing.get_context('fork'))
+
+    with executor:
+        futures = [executor.submit(track_and_crop_group, opt, group, faces[group[0][0]:group[-1][1]], group[0][0])
+                   for group in groups]
+
+        # Collect in submission order so numbering matches the sequential path
+        alltracks = []
+        for future in futures:
+            tracks, output_files = future.result()
+            for track, output_file in zip(tracks, output_files):
+                # Tracks dropped while cropping have no file, but keep their number
+                if os.path.exists(output_file):
+                    os.replace(output_file, os.path.join(opt.crop_dir, opt.reference, f'{len(alltracks):05d}.avi'))
+                alltracks.append(track)
+
+    return alltracks
+
+# ========== ========== ========== ==========
+# # IN-PROCESS SYNCNET EVALUATION
+# ========== ========== ========== ==========
+
+def shard_sample(frames, audio, mfcc, start_frame, crop_size=112, region='face'):
+    """Training arrays for one track: resized uint8 crops and the aligned PCM and MFCC.
+
+    region 'mouth' keeps the lower half of each face crop. PCM is 640 samples
+    and MFCC 4 columns per 25 fps video frame, both starting at start_frame.
+    """
+    if region == 'mouth':
+        frames = frames[:, frames.shape[1] // 2:]
+        size = (crop_size, crop_size // 2)
+    else:
+        size = (crop_size, crop_size)
+    crops = np.stack([cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames])
+
+    num_frames = len(frames)
+    pcm = audio[start_frame * 640:(start_frame + num_frames) * 640]
+    mfcc = mfcc[:, start_frame * 4:(start_frame + num_frames) * 4].T.astype(np.float32)
+    return {'frames': crops, 'pcm': pcm, 'mfcc': mfcc}
+
+def evaluate_tracks(opt, s, tracks, write_crops=False, writer=None):
+    """Crop tracks in memory and hand each one straight to SyncNet.
+
+    The audio tower runs once over the whole reference; every track is scored
+    against the slice of those embeddings that covers its frames. Returns one
+    (offset, conf, dists) tuple per track, or None where evaluation failed, plus
+    the active speaker confidence matrix and per-frame speaker index from
+    active_speaker_matrix. With write_crops the encoded crop videos are also written.
+    With a ShardWriter, every evaluated track is also exported as a training
+    sample with its offset and confidence.
+    """
+    sample_rate, audio = wavfile.read(os.path.join(opt.avi_dir, opt.reference, 'audio.wav'))
+    mfcc = compute_mfcc(audio, sample_rate)
+    cc_feat = s.embed_audio(opt, audio, sample_rate, mfcc=mfcc)
+
+    results = [None] * len(tracks)
+    im_feats = {}
+
+    def on_track(tidx, frames):
+        print(f"Evaluating track {tidx+1}/{len(tracks)}")
+        try:
+            offset, conf, dists, im_feat = s.evaluate_track(opt, frames, cc_feat, int(tracks[tidx]['track']['frame'][0]))
+            results[tidx] = (offset, conf, dists)
+            im_feats[tidx] = im_feat
+        except Exception as e:
+            print(f"Error evaluating track {tidx}: {e}")
+            return
+        if writer is not None:
+            start_frame = int(tracks[tidx]['track']['frame'][0])
+            writer.add(f"{opt.reference}/{tidx:05d}",
+                       meta={'reference': opt.reference, 'track': tidx, 'start_frame': start_frame,
+                             'num_frames': len(frames), 'offset': int(offset), 'conf': float(conf)},
+                       **shard_sample(frames, audio, mfcc, start_frame, opt.shard_crop_size, opt.shard_region))
+
+    bus = FrameBus(frame_source(opt))
+    bus.register(TrackArrayConsumer(tracks, on_track, crop_scale=opt.crop_scale))
+    if write_crops and tracks:
+        output_files = [os.path.join(opt.crop_dir, opt.reference, f'{ii:05d}.avi') for ii in range(len(tracks))]
+        os.makedirs(os.path.dirname(output_files[0]), exist_ok=True)
+        bus.register(TrackVideoConsumer(tracks, output_files, os.path.join(opt.avi_dir, opt.reference, 'audio.wav'),
+                                        frame_rate=opt.frame_rate, crop_scale=opt.crop_scale))
+    num_frames = bus.run()
+
+    evaluated = sorted(im_feats)
+    conf, speaker = active_speaker_matrix([im_feats[t] for t in evaluated],
+                                          [int(tracks[t]['track']['frame'][0]) for t in evaluated], cc_feat, num_frames)
+
+    # Rows for tracks that could not be evaluated stay NaN
+    speaker_conf = np.full((len(tracks), num_frames), np.nan)
+    speaker_conf[evaluated] = conf
+    speaker = np.where(speaker >= 0, np.array(evaluated + [-1])[speaker], -1)
+
+    return results, speaker_conf, speaker
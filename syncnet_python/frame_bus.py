@@ -0,0 +1,368 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import collections
+import subprocess
+import numpy as np
+import cv2
+
+from shot_detect import ShotDetector
+from frame_store import FrameStore
+
+# ========== ========== ========== ==========
+# # FRAME BUS
+# ========== ========== ========== ==========
+
+class FrameWindow(object):
+    """Read-only view of the frames buffered around the frame being consumed."""
+
+    def __init__(self, buffer, lo, hi):
+        self._buffer = buffer
+        self.lo = lo
+        self.hi = hi
+
+    def __contains__(self, idx):
+        return self.lo <= idx <= self.hi
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise IndexError('frame %d outside window [%d, %d]' % (idx, self.lo, self.hi))
+        return self._buffer[idx - self._buffer.first]
+
+
+class _FrameBuffer(collections.deque):
+
+    first = 0
+
+    def push(self, frame):
+        if len(self) == self.maxlen:
+            self.first += 1
+        self.append(frame)
+
+
+class FrameConsumer(object):
+    """Base class for stages fed by a FrameBus.
+
+    `lookback` and `lookahead` declare how many frames around the current one
+    must be reachable through the window passed to `consume`. A consumer with
+    lookahead L receives frame i only once frame i + L has been decoded, or at
+    the end of the stream.
+    """
+
+    lookback = 0
+    lookahead = 0
+
+    def start(self, width, height, fps):
+        pass
+
+    def consume(self, idx, frame, window):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class FrameBus(object):
+    """Decode a video once and fan each BGR frame out to the registered consumers.
+
+    Only max(lookback) + max(lookahead) + 1 frames are ever held in memory.
+    `start` and `end` restrict decoding to frames [start, end) with a single seek.
+
+    `videofile` may also be a FrameStore, whose frames are then passed on as
+    read-only views instead of being decoded.
+    """
+
+    def __init__(self, videofile, start=0, end=None):
+        self.videofile = videofile
+        self.start = start
+        self.end = end
+        self.consumers = []
+
+    def register(self, consumer):
+        self.consumers.append(consumer)
+        return consumer
+
+    def _open(self):
+        """(width, height, fps, iterator over frames [start, end))."""
+        if isinstance(self.videofile, FrameStore):
+            store = self.videofile
+            end = len(store) if self.end is None else min(self.end, len(store))
+            return store.width, store.height, store.fps, (store[i] for i in range(self.start, end))
+
+        cap = cv2.VideoCapture(self.videofile)
+        if self.start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+
+        def frames():
+            idx = self.start
+            while self.end is None or idx < self.end:
+                idx += 1
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+            cap.release()
+
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.get(cv2.CAP_PROP_FPS), frames()
+
+    def run(self):
+        width, height, fps, frames = self._open()
+
+        lookback = max([c.lookback for c in self.consumers] + [0])
+        lookahead = max([c.lookahead for c in self.consumers] + [0])
+        buffer = _FrameBuffer(maxlen=lookback + lookahead + 1)
+        buffer.first = self.start
+
+        for consumer in self.consumers:
+            consumer.start(width, height, fps)
+
+        # Next frame index owed to each consumer
+        pending = [self.start] * len(self.consumers)
+        num_frames = 0
+
+        for frame in frames:
+            buffer.push(frame)
+            num_frames += 1
+            self._dispatch(buffer, pending, self.start + num_frames - 1)
+
+        # Drain consumers still waiting on lookahead frames
+        self._dispatch(buffer, pending, self.start + num_frames - 1, final=True)
+
+        for consumer in self.consumers:
+            consumer.finish()
+
+        return num_frames
+
+    def _dispatch(self, buffer, pending, newest, final=False):
+        for c, consumer in enumerate(self.consumers):
+            while pending[c] <= newest and (final or pending[c] + consumer.lookahead <= newest):
+                idx = pending[c]
+                window = FrameWindow(buffer, max(idx - consumer.lookback, buffer.first), min(idx + consumer.lookahead, newest))
+                consumer.consume(idx, window[idx], window)
+                pending[c] += 1
+
+# ========== ========== ========== ==========
+# # CONSUMERS
+# ========== ========== ========== ==========
+
+class ShotConsumer(FrameConsumer):
+    """Downscale frames and feed them to a ShotDetector in blocks."""
+
+    def __init__(self, size=(128, 72), colorspace='gray', block_size=250, **kwargs):
+        self.size = size
+        self.colorspace = colorspace
+        self.block_size = block_size
+        self.detector = ShotDetector(**kwargs)
+        self._block = []
+
+    def consume(self, idx, frame, window):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if self.colorspace == 'gray':
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        else:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        self._block.append(small)
+        if len(self._block) == self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if self._block:
+            self.detector.update(np.stack(self._block))
+            self._block = []
+
+    def finish(self):
+        self._flush()
+
+    def scene_list(self):
+        return self.detector.scene_list()
+
+
+class FaceDetConsumer(FrameConsumer):
+    """Run S3FD on batches of frames; `dets` has the layout stored in faces.pckl."""
+
+    def __init__(self, detector, batch_size=8, conf_th=0.9, scales=[0.25]):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.conf_th = conf_th
+        self.scales = scales
+        self.dets = []
+        self._batch = []
+
+    def consume(self, idx, frame, window):
+        self._batch.append((idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        if len(self._batch) == self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        results = self.detector.detect_faces_batch([image for _, image in self._batch], conf_th=self.conf_th, scales=self.scales)
+        for (fidx, _), bboxes in zip(self._batch, results):
+            self.dets.append([{'frame': fidx, 'bbox': (bbox[:-1]).tolist(), 'conf': bbox[-1]} for bbox in bboxes])
+        print(f'Frame {fidx:05d}; {len(self.dets[-1])} detections')
+        self._batch = []
+
+    def finish(self):
+        self._flush()
+
+
+def crop_face(frame, x, y, s, crop_scale, size=224):
+    """Crop a smoothed face box with margins and resize it to size x size.
+
+    Equivalent to padding the frame by the margin with grey (110) and cutting
+    the box from the padded frame, but only the crop region is ever padded.
+    Raises ValueError for a box with no size or entirely outside the frame.
+    """
+    if not s > 0:
+        raise ValueError('face box of size %r' % s)
+    bsi = int(s * (1 + 2 * crop_scale))
+    my = y + bsi
+    mx = x + bsi
+    y1, y2 = int(my - s) - bsi, int(my + s * (1 + 2 * crop_scale)) - bsi
+    x1, x2 = int(mx - s * (1 + crop_scale)) - bsi, int(mx + s * (1 + crop_scale)) - bsi
+
+    h, w = frame.shape[:2]
+    face = frame[max(y1, 0):min(y2, h), max(x1, 0):min(x2, w)]
+    if face.size == 0:
+        raise ValueError('face box (%d, %d, %d, %d) is empty within a %dx%d frame' % (x1, y1, x2, y2, w, h))
+    face = cv2.copyMakeBorder(face, max(-y1, 0), max(y2 - h, 0), max(-x1, 0), max(x2 - w, 0),
+                              cv2.BORDER_CONSTANT, value=(110, 110, 110))
+    return cv2.resize(face, (size, size))
+
+
+class TrackVideoConsumer(FrameConsumer):
+    """Crop every track in a single sequential pass and stream the crops into one
+    ffmpeg encoder per track, muxing in the matching slice of the reference audio.
+
+    `tracks` are {'track', 'proc_track'} entries as produced by the tracker.
+    An encoder is started on a track's first frame and closed on its last, so
+    only tracks that are live at the same time hold a pipe open. A track whose
+    box cannot be cropped is dropped, and its partial output file removed.
+    """
+
+    def __init__(self, tracks, output_files, audiofile, frame_rate=25, crop_scale=0.40, size=224):
+        self.tracks = tracks
+        self.output_files = output_files
+        self.audiofile = audiofile
+        self.frame_rate = frame_rate
+        self.crop_scale = crop_scale
+        self.size = size
+        self.schedule = collections.defaultdict(list)
+        for tidx, track in enumerate(tracks):
+            for k, frame_num in enumerate(track['track']['frame'].tolist()):
+                self.schedule[frame_num].append((tidx, k))
+        self._encoders = {}
+        self._closed = []
+        self.dropped = set()
+
+    def _open(self, tidx):
+        frames = self.tracks[tidx]['track']['frame']
+        audiostart = frames[0] / float(self.frame_rate)
+        duration = len(frames) / float(self.frame_rate)
+        command = ['ffmpeg', '-y', '-v', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '%dx%d' % (self.size, self.size),
+                   '-r', str(self.frame_rate), '-i', '-',
+                   '-ss', '%.3f' % audiostart, '-t', '%.3f' % duration, '-i', self.audiofile,
+                   '-map', '0:v', '-map', '1:a', '-c:v', 'mpeg4', '-qscale:v', '2',
+                   '-c:a', 'pcm_s16le', self.output_files[tidx]]
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def _drop(self, tidx, error):
+        print(f'Track {tidx} dropped: {error}')
+        self.dropped.add(tidx)
+        encoder = self._encoders.pop(tidx, None)
+        if encoder is not None:
+            encoder.kill()
+            encoder.wait()
+            if os.path.exists(self.output_files[tidx]):
+                os.remove(self.output_files[tidx])
+
+    def consume(self, idx, frame, window):
+        for tidx, k in self.schedule.pop(idx, []):
+            if tidx in self.dropped:
+                continue
+            proc_track = self.tracks[tidx]['proc_track']
+            try:
+                face = crop_face(frame, proc_track['x'][k], proc_track['y'][k], proc_track['s'][k], self.crop_scale, self.size)
+            except ValueError as e:
+                # One bad track must not stop the decode shared with every other consumer
+                self._drop(tidx, e)
+                continue
+            if tidx not in self._encoders:
+                self._encoders[tidx] = self._open(tidx)
+            self._encoders[tidx].stdin.write(face.tobytes())
+
+            if k == len(proc_track['s']) - 1:
+                encoder = self._encoders.pop(tidx)
+                encoder.stdin.close()
+                self._closed.append(encoder)
+
+        # Reap encoders that have finished flushing
+        self._closed = [encoder for encoder in self._closed if encoder.poll() is None]
+
+    def finish(self):
+        for encoder in self._encoders.values():
+            encoder.stdin.close()
+            self._closed.append(encoder)
+        self._encoders = {}
+        for encoder in self._closed:
+            encoder.wait()
+        self._closed = []
+
+
+class TrackArrayConsumer(FrameConsumer):
+    """Crop every track in a single sequential pass into in-memory uint8 arrays.
+
+    `callback(tidx, frames)` is called with a (T, size, size, 3) BGR array as soon
+    as the last frame of track tidx is decoded, after which the array is released.
+    A track cut short by the end of the video is passed with only the frames
+    that were decoded, or dropped if it has fewer than min_frames. A track whose
+    box cannot be cropped is dropped and never passed to the callback.
+    """
+
+    def __init__(self, tracks, callback, crop_scale=0.40, size=224, min_frames=5):
+        self.tracks = tracks
+        self.callback = callback
+        self.crop_scale = crop_scale
+        self.size = size
+        self.min_frames = min_frames
+        self.schedule = collections.defaultdict(list)
+        for tidx, track in enumerate(tracks):
+            for k, frame_num in enumerate(track['track']['frame'].tolist()):
+                self.schedule[frame_num].append((tidx, k))
+        self._frames = {}
+        self._written = {}
+        self.dropped = set()
+
+    def consume(self, idx, frame, window):
+        for tidx, k in self.schedule.pop(idx, []):
+            if tidx in self.dropped:
+                continue
+            proc_track = self.tracks[tidx]['proc_track']
+            try:
+                face = crop_face(frame, proc_track['x'][k], proc_track['y'][k], proc_track['s'][k], self.crop_scale, self.size)
+            except ValueError as e:
+                print(f'Track {tidx} dropped: {e}')
+                self.dropped.add(tidx)
+                self._frames.pop(tidx, None)
+                self._written.pop(tidx, None)
+                continue
+            if tidx not in self._frames:
+                self._frames[tidx] = np.empty((len(proc_track['s']), self.size, self.size, 3), dtype=np.uint8)
+            self._frames[tidx][k] = face
+            # Track frames are consecutive, so this is also the number of rows filled
+            self._written[tidx] = k + 1
+
+            if k == len(proc_track['s']) - 1:
+                del self._written[tidx]
+                self.callback(tidx, self._frames.pop(tidx))
+
+    def finish(self):
+        # Tracks cut short by the end of the video; the rest of their buffer was never written
+        for tidx in sorted(self._frames):
+            frames, n = self._frames.pop(tidx), self._written.pop(tidx)
+            if n < self.min_frames:
+                print(f'Track {tidx} dropped: only {n} of {len(frames)} frames decoded')
+                continue
+            self.callback(tidx, frames[:n])
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import struct
+import tempfile
+import subprocess
+import numpy
+import cv2
+
+# ==================== FRAME STORE ====================
+#
+# One file per reference: a 64-byte header followed by the raw uint8 BGR
+# frames back to back, so frame i starts at HEADER_SIZE + i * frame_bytes.
+
+MAGIC = b'SNFRAME1'
+HEADER = struct.Struct('<8sQIIIdd')
+HEADER_SIZE = 64
+
+def frame_store_path(opt):
+    return os.path.join(opt.frames_dir, opt.reference, 'frames.u8')
+
+class FrameStoreWriter(object):
+    """Append frames to a frame store; the frame count in the header is
+    written on close, so a reader never sees frames that are not complete."""
+
+    def __init__(self, path, height, width, channels=3, fps=25.0, scale=1.0):
+        self.path = path
+        self.shape = (height, width, channels)
+        self.fps = fps
+        self.scale = scale
+        self.frame_bytes = height * width * channels
+        self.num_frames = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._fil = open(path, 'wb')
+        self._write_header()
+        self._fil.seek(HEADER_SIZE)
+
+    def _write_header(self):
+        header = HEADER.pack(MAGIC, self.num_frames, self.shape[0], self.shape[1], self.shape[2], self.fps, self.scale)
+        self._fil.seek(0)
+        self._fil.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def write(self, frames):
+        """Append one (H, W, C) frame or an (N, H, W, C) block."""
+        frames = numpy.ascontiguousarray(frames, dtype=numpy.uint8)
+        assert frames.shape[-3:] == self.shape, 'frame shape %s, store shape %s' % (frames.shape[-3:], self.shape)
+        self._fil.write(frames.tobytes())
+        self.num_frames += frames.size // self.frame_bytes
+
+    def write_bytes(self, data):
+        """Append whole frames from a raw bgr24 byte string."""
+        assert len(data) % self.frame_bytes == 0
+        self._fil.write(data)
+        self.num_frames += len(data) // self.frame_bytes
+
+    def close(self):
+        self._write_header()
+        self._fil.flush()
+        os.fsync(self._fil.fileno())
+        self._fil.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameStore(object):
+    """Read-only, memory-mapped frame store.
+
+    Indexing returns views: store[i] is one (H, W, C) frame and store[i:j]
+    an (N, H, W, C) block, with no decode or copy. `scale` is the working
+    resolution relative to the source video, for mapping coordinates back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fil:
+            magic, num_frames, height, width, channels, fps, scale = HEADER.unpack(fil.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a frame store' % path)
+        self.shape = (num_frames, height, width, channels)
+        self.fps = fps
+        self.scale = scale
+        self.frames = numpy.memmap(path, dtype=numpy.uint8, mode='r', offset=HEADER_SIZE, shape=self.shape) if num_frames else numpy.zeros(self.shape, dtype=numpy.uint8)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        return self.frames[idx]
+
+    @property
+    def width(self):
+        return self.shape[2]
+
+    @property
+    def height(self):
+        return self.shape[1]
+
+# ==================== WRITE FROM FFMPEG ====================
+
+def store_size(width, height, scale=1.0):
+    """Working resolution for a source of width x height, rounded to even sizes."""
+    if scale == 1.0:
+        return width, height
+    return max(2, int(round(width * scale / 2.0)) * 2), max(2, int(round(height * scale / 2.0)) * 2)
+
+def copy_raw_frames(command, writer):
+    """Run an ffmpeg command whose raw bgr24 output goes to pipe:1 and append
+    every frame to writer. Returns ffmpeg's return code and stderr."""
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=err)
+        while True:
+            data = proc.stdout.read(writer.frame_bytes)
+            if len(data) < writer.frame_bytes:
+                break
+            writer.write_bytes(data)
+        proc.stdout.close()
+        returncode = proc.wait()
+        err.seek(0)
+        return returncode, err.read().decode('utf-8', 'replace')[-2000:]
+
+def _raw_frames_command(videofile, scale=1.0, threads=0):
+    """ffmpeg command writing videofile's frames as raw bgr24 to pipe:1, with
+    the output width and height, the fps and the source width."""
+    cap = cv2.VideoCapture(videofile)
+    source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    width, height = store_size(source_width, int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), scale)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    command = ['ffmpeg', '-v', 'error', '-threads', str(threads), '-i', videofile, '-map', '0:v:0']
+    if scale != 1.0:
+        command += ['-vf', 'scale=%d:%d' % (width, height)]
+    command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    return command, width, height, fps, source_width
+
+def read_frames(videofile, threads=0):
+    """Decode every frame of videofile straight into a (T, H, W, 3) uint8 array, with no file in between."""
+    command, width, height, _, _ = _raw_frames_command(videofile, threads=threads)
+    data = bytearray()
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=err)
+        for chunk in iter(lambda: proc.stdout.read(1 << 22), b''):
+            data += chunk
+        proc.stdout.close()
+        returncode = proc.wait()
+        err.seek(0)
+        stderr = err.read().decode('utf-8', 'replace')[-2000:]
+    if returncode != 0:
+        raise RuntimeError('ffmpeg failed on %s: %s' % (videofile, stderr))
+
+    frame_bytes = width * height * 3
+    # A bytearray keeps the frames writable without another copy
+    return numpy.frombuffer(data, dtype=numpy.uint8, count=len(data) // frame_bytes * frame_bytes).reshape(-1, height, width, 3)
+
+def write_frame_store(videofile, path, scale=1.0, threads=0):
+    """Decode every frame of videofile into a frame store at path."""
+    command, width, height, fps, source_width = _raw_frames_command(videofile, scale, threads)
+
+    with FrameStoreWriter(path, height, width, fps=fps, scale=width / float(source_width)) as writer:
+        returncode, stderr = copy_raw_frames(command, writer)
+    if returncode != 0:
+        raise RuntimeError('ffmpeg failed on %s: %s' % (videofile, stderr))
+
+    return FrameStore(path)
+
+# ==================== PIPELINE ====================
+
+def frame_source(opt):
+    """What a FrameBus over opt.reference should read: its frame store when
+    opt.frame_store is set and the store is at full resolution, else video.avi."""
+    path = frame_store_path(opt)
+    if getattr(opt, 'frame_store', False) and os.path.exists(path):
+        store = FrameStore(path)
+        if store.scale == 1.0:
+            return store
+    return os.path.join(opt.avi_dir, opt.reference, 'video.avi')
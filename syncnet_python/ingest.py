@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import json
+import subprocess
+from fractions import Fraction
+
+from frame_store import FrameStoreWriter, store_size, copy_raw_frames
+
+# Video codecs that are stream-copied from an AVI input into video.avi when already at the target rate
+PASSTHROUGH_CODECS = {'mpeg4', 'mjpeg', 'h264', 'msmpeg4v2', 'msmpeg4v3', 'mpeg2video'}
+
+# ==================== PROBE ====================
+
+def probe(videofile):
+    """ffprobe's stream and format description of a file, or None if it cannot be read."""
+    command = ['ffprobe', '-v', 'error', '-of', 'json', '-show_streams', '-show_format', videofile]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.decode('utf-8'))
+
+def _stream(info, codec_type):
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == codec_type:
+            return stream
+    return None
+
+def _rate(value):
+    try:
+        return Fraction(value)
+    except (ValueError, ZeroDivisionError, TypeError):
+        return None
+
+def is_conformant(info, frame_rate=25):
+    """True when an AVI input's first video stream is constant frame_rate fps
+    in a codec that can be copied into video.avi, and its audio starts with it.
+
+    AVI cannot carry per-stream start times or edit lists, so copying video
+    out of MP4, MOV or MKV could bake an A/V offset into video.avi; those
+    inputs, and AVIs whose streams start apart, are always transcoded.
+    """
+    if info is None or 'avi' not in info.get('format', {}).get('format_name', '').split(','):
+        return False
+    video = _stream(info, 'video')
+    audio = _stream(info, 'audio')
+    if video is None or audio is None:
+        return False
+    return (video.get('codec_name') in PASSTHROUGH_CODECS
+            and _rate(video.get('r_frame_rate')) == frame_rate
+            and _rate(video.get('avg_frame_rate')) == frame_rate
+            and _rate(video.get('start_time', '0')) == _rate(audio.get('start_time', '0')))
+
+# ==================== INGEST ====================
+
+def ingest_command(videofile, video_out, audio_out, frames_pattern=None, passthrough=False, frame_rate=25, threads=0, frames_size=None):
+    """One ffmpeg call writing video.avi, 16 kHz mono audio.wav and, optionally, frames.
+
+    The input is decoded once; split / asplit feed every output from the same
+    decoded frames and samples. With passthrough the video stream is copied
+    into video.avi instead of re-encoded. threads=0 lets ffmpeg decide.
+
+    frames_pattern is a JPEG pattern, or 'pipe:1' for raw bgr24 frames on
+    stdout (see ingest's frame_store), scaled to frames_size if given.
+    """
+    threads = str(threads)
+    graph = ['[0:a:0]aresample=async=1,asplit=2[aout][awav]']
+    if passthrough:
+        video_map = frames_map = '0:v:0'
+    elif frames_pattern:
+        graph.insert(0, '[0:v:0]fps=%d,split=2[vout][vframes]' % frame_rate)
+        video_map, frames_map = '[vout]', '[vframes]'
+    else:
+        graph.insert(0, '[0:v:0]fps=%d[vout]' % frame_rate)
+        video_map = '[vout]'
+    if frames_pattern and frames_size:
+        graph.append('[%s]scale=%d:%d[vscaled]' % (frames_map.strip('[]'), frames_size[0], frames_size[1]))
+        frames_map = '[vscaled]'
+
+    command = ['ffmpeg', '-y', '-v', 'error', '-threads', threads, '-i', videofile,
+               '-filter_complex', ';'.join(graph), '-filter_complex_threads', threads]
+
+    command += ['-map', video_map, '-map', '[aout]', '-threads', threads]
+    if passthrough:
+        command += ['-c:v', 'copy', '-acodec', 'pcm_s16le']
+    else:
+        command += ['-qscale:v', '2']
+    command += [video_out]
+
+    if frames_pattern == 'pipe:1':
+        command += ['-map', frames_map, '-f', 'rawvideo', '-pix_fmt', 'bgr24', frames_pattern]
+    elif frames_pattern:
+        command += ['-map', frames_map, '-threads', threads, '-qscale:v', '2', '-f', 'image2', frames_pattern]
+
+    command += ['-map', '[awav]', '-ac', '1', '-ar', '16000', '-acodec', 'pcm_s16le', audio_out]
+
+    return command
+
+def ingest(videofile, video_out, audio_out, frames_pattern=None, frame_rate=25, threads=0, passthrough='auto',
+           frame_store=None, frame_store_scale=1.0):
+    """Run ingest_command. passthrough is 'auto' (copy when is_conformant), True or False.
+
+    With frame_store, the frames go to a FrameStore at that path, at
+    frame_store_scale of the source resolution, instead of to frames_pattern.
+    Returns 'passthrough' or 'transcode', or None if ffmpeg failed.
+    """
+    info = probe(videofile) if passthrough == 'auto' or frame_store else None
+    if passthrough == 'auto':
+        passthrough = is_conformant(info, frame_rate)
+
+    if frame_store:
+        video = _stream(info or {}, 'video')
+        if video is None:
+            print('No video stream found in %s' % videofile)
+            return None
+        width, height = store_size(int(video['width']), int(video['height']), frame_store_scale)
+        command = ingest_command(videofile, video_out, audio_out, 'pipe:1', passthrough, frame_rate, threads,
+                                 frames_size=(width, height) if frame_store_scale != 1.0 else None)
+        with FrameStoreWriter(frame_store, height, width, fps=frame_rate, scale=width / float(video['width'])) as writer:
+            returncode, stderr = copy_raw_frames(command, writer)
+    else:
+        command = ingest_command(videofile, video_out, audio_out, frames_pattern, passthrough, frame_rate, threads)
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        returncode, stderr = result.returncode, result.stderr.decode('utf-8', 'replace')[-2000:]
+
+    if returncode != 0:
+        print(stderr)
+        return None
+
+    return 'passthrough' if passthrough else 'transcode'
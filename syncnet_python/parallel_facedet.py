@@ -0,0 +1,176 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import cv2
+
+from frame_bus import FrameBus, FrameConsumer
+from frame_store import FrameStore, frame_store_path
+
+# ========== ========== ========== ==========
+# # FRAME RING
+# ========== ========== ========== ==========
+
+class FrameRing(object):
+    """A fixed number of frame slots in one shared memory block.
+
+    The creating process owns the block and unlinks it on close; other
+    processes attach by name. `slots` is an (N, H, W, C) uint8 array over the
+    block, so frames are written and read in place, never pickled.
+    """
+
+    def __init__(self, num_slots, shape, name=None):
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.owner = name is None
+        size = num_slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if self.owner else shared_memory.SharedMemory(name=name)
+        self.slots = np.ndarray((num_slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # Views into the buffer must be gone before it can be closed
+        del self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# ========== ========== ========== ==========
+# # DECODER AND WORKERS
+# ========== ========== ========== ==========
+
+class RingWriter(FrameConsumer):
+    """Copy each frame into a free ring slot and queue its index for detection.
+
+    Slots come back through free_slots once a worker is done with them, so
+    decoding blocks while every slot is in use.
+    """
+
+    def __init__(self, ring, free_slots, tasks):
+        self.ring = ring
+        self.free_slots = free_slots
+        self.tasks = tasks
+
+    def consume(self, idx, frame, window):
+        slot = self.free_slots.get()
+        self.ring.slots[slot] = frame
+        self.tasks.put((idx, slot))
+
+
+def _decoder(source, is_store, ring_name, num_slots, shape, free_slots, tasks, results, num_workers):
+    ring = FrameRing(num_slots, shape, name=ring_name)
+    try:
+        bus = FrameBus(FrameStore(source) if is_store else source)
+        bus.register(RingWriter(ring, free_slots, tasks))
+        num_frames = bus.run()
+    finally:
+        for _ in range(num_workers):
+            tasks.put(None)
+        ring.close()
+    results.put(('count', num_frames))
+
+
+def make_s3fd(device):
+    from detectors import S3FD
+    return S3FD(device=device)
+
+
+def _worker(ring_name, num_slots, shape, free_slots, tasks, results, make_detector, device, threads, conf_th, scale, store_scale):
+    import torch
+    torch.set_num_threads(threads)
+
+    ring = FrameRing(num_slots, shape, name=ring_name)
+    detector = make_detector(device)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            idx, slot = task
+            # cvtColor makes the worker's own copy, so the slot is free right after it
+            image = cv2.cvtColor(ring.slots[slot], cv2.COLOR_BGR2RGB)
+            free_slots.put(slot)
+
+            bboxes = detector.detect_faces(image, conf_th=conf_th, scales=[scale / store_scale])
+            bboxes[:, :4] /= store_scale
+            results.put(('frame', idx, [{'frame': idx, 'bbox': (bbox[:-1]).tolist(), 'conf': bbox[-1]} for bbox in bboxes]))
+    finally:
+        ring.close()
+
+# ========== ========== ========== ==========
+# # DETECTION
+# ========== ========== ========== ==========
+
+def detect_faces_parallel(opt, num_workers, num_slots=None, device='cpu', threads=1, conf_th=0.9, make_detector=make_s3fd):
+    """Face detection over opt.reference with one decoder and num_workers detector processes.
+
+    The decoder reads the frame store (any scale) if opt.frame_store is set,
+    else video.avi, into a shared FrameRing of num_slots frames (default
+    2 * num_workers), which bounds memory however far decoding runs ahead.
+    Workers take (frame, slot) pairs from a queue and detect on the slot in
+    place. Returns detections in frame order, in the layout of faces.pckl.
+    """
+    num_slots = num_slots or 2 * num_workers
+
+    store_path = frame_store_path(opt)
+    if getattr(opt, 'frame_store', False) and os.path.exists(store_path):
+        store = FrameStore(store_path)
+        source, is_store, shape, store_scale = store_path, True, (store.height, store.width, 3), store.scale
+    else:
+        source = os.path.join(opt.avi_dir, opt.reference, 'video.avi')
+        cap = cv2.VideoCapture(source)
+        shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        cap.release()
+        is_store, store_scale = False, 1.0
+
+    # fork, as run_pipeline.py has no main guard; the detectors are created in the workers
+    ctx = multiprocessing.get_context('fork')
+    ring = FrameRing(num_slots, shape)
+    free_slots, tasks, results = ctx.Queue(), ctx.Queue(num_slots), ctx.Queue()
+    for slot in range(num_slots):
+        free_slots.put(slot)
+
+    procs = [ctx.Process(target=_decoder, args=(source, is_store, ring.name, num_slots, shape, free_slots, tasks, results, num_workers))]
+    procs += [ctx.Process(target=_worker, args=(ring.name, num_slots, shape, free_slots, tasks, results, make_detector,
+                                                device, threads, conf_th, opt.facedet_scale, store_scale))
+              for _ in range(num_workers)]
+
+    dets = {}
+    num_frames = None
+    tS = time.time()
+    try:
+        for proc in procs:
+            proc.start()
+
+        while num_frames is None or len(dets) < num_frames:
+            try:
+                msg = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(proc.is_alive() for proc in procs):
+                    raise RuntimeError('Face detection processes exited after %d frames' % len(dets))
+                continue
+            if msg[0] == 'count':
+                num_frames = msg[1]
+            else:
+                dets[msg[1]] = msg[2]
+                if len(dets) % 100 == 0:
+                    print(f'{len(dets)} frames detected; {len(dets) / (time.time() - tS):.2f} Hz')
+
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        ring.close()
+
+    return [dets[idx] for idx in range(num_frames)]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import asyncio
+
+from ingest import probe, is_conformant, ingest_command
+
+# ==================== MANIFEST ====================
+
+def read_items(path):
+    """Input manifest: one `videofile[,reference]` per line; the reference
+    defaults to the file name without extension."""
+    items = []
+    with open(path) as fil:
+        for line in fil:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            videofile, _, reference = line.partition(',')
+            reference = reference.strip() or os.path.splitext(os.path.basename(videofile))[0]
+            items.append({'videofile': os.path.abspath(videofile.strip()), 'reference': reference})
+    return items
+
+def in_shard(reference, shard, num_shards):
+    """Deterministic shard assignment from the reference, independent of manifest order."""
+    digest = hashlib.sha1(reference.encode('utf-8')).hexdigest()
+    return int(digest, 16) % num_shards == shard
+
+def shard_spec(value):
+    """argparse type for --shard: `i/N` with 0 <= i < N, as (i, N)."""
+    try:
+        shard, num_shards = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= shard < num_shards:
+        raise argparse.ArgumentTypeError(f"shard {value!r} needs 0 <= i < N")
+    return shard, num_shards
+
+class StatusLog(object):
+    """Crash-safe, append-only JSON-lines record of per-item status.
+
+    Every record is flushed and fsynced; on load the last record per reference
+    wins and a torn final line from a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status = {}
+        if os.path.exists(path):
+            with open(path) as fil:
+                for line in fil:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.status[rec['reference']] = rec
+        self._fil = open(path, 'a')
+        if self._fil.tell() > 0:
+            with open(path, 'rb') as fil:
+                fil.seek(-1, os.SEEK_END)
+                if fil.read(1) != b'\n':
+                    self._fil.write('\n')
+
+    def record(self, reference, status, **fields):
+        rec = dict(reference=reference, status=status, time=time.time(), **fields)
+        self._fil.write(json.dumps(rec) + '\n')
+        self._fil.flush()
+        os.fsync(self._fil.fileno())
+        self.status[reference] = rec
+
+    def get(self, reference):
+        return self.status.get(reference, {}).get('status')
+
+    def close(self):
+        self._fil.close()
+
+# ==================== STAGES ====================
+
+async def run_command(command, cwd=None):
+    proc = await asyncio.create_subprocess_exec(*command, cwd=cwd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await proc.communicate()
+    return proc.returncode, stderr.decode('utf-8', 'replace')[-2000:]
+
+async def ingest(opt, item):
+    """Transcode to 25 fps video.avi and extract 16 kHz mono audio.wav, as run_pipeline.py does."""
+    avi_dir = os.path.join(opt.data_dir, 'pyavi', item['reference'])
+    for sub in ['pyavi', 'pywork', 'pycrop', 'pytmp', 'pyframes']:
+        os.makedirs(os.path.join(opt.data_dir, sub, item['reference']), exist_ok=True)
+
+    info = await asyncio.get_running_loop().run_in_executor(None, probe, item['videofile'])
+    command = ingest_command(item['videofile'], os.path.join(avi_dir, 'video.avi'), os.path.join(avi_dir, 'audio.wav'),
+                             passthrough=is_conformant(info), threads=opt.ffmpeg_threads)
+    returncode, stderr = await run_command(command)
+    return stderr if returncode != 0 else None
+
+def is_ingested(opt, log, reference):
+    """True when an item got past ingest, by its status, and its video.avi and
+    audio.wav are still there, so a rerun can start at the model stage."""
+    rec = log.status.get(reference, {})
+    past_ingest = rec.get('status') in ('ingested', 'running') or (rec.get('status') == 'failed' and rec.get('stage') == 'model')
+    avi_dir = os.path.join(opt.data_dir, 'pyavi', reference)
+    return past_ingest and all(os.path.exists(os.path.join(avi_dir, name)) for name in ('video.avi', 'audio.wav'))
+
+async def model(opt, item):
+    """Detection, tracking and in-process SyncNet via run_pipeline.py on the ingested files."""
+    command = [sys.executable, 'run_pipeline.py', '--data_dir', opt.data_dir,
+               '--videofile', item['videofile'], '--reference', item['reference'],
+               '--skip_ingest', '--frame_bus', '--syncnet'] + shlex.split(opt.pipeline_args)
+    # run_pipeline.py loads detector weights relative to its own directory
+    returncode, stderr = await run_command(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return stderr if returncode != 0 else None
+
+# ==================== RUNNER ====================
+
+async def run(opt, items, log):
+    queue = asyncio.Queue(maxsize=opt.queue_size)
+    ingest_slots = asyncio.Semaphore(opt.ingest_jobs)
+    # Seconds each item spent in ingest and in the model stage, not counting queueing
+    timings = {}
+
+    async def ingest_one(item):
+        ref = item['reference']
+        timings[ref] = {}
+        if not is_ingested(opt, log, ref):
+            async with ingest_slots:
+                tS = time.time()
+                log.record(ref, 'ingesting')
+                error = await ingest(opt, item)
+                timings[ref]['ingest'] = time.time() - tS
+            if error is not None:
+                log.record(ref, 'failed', stage='ingest', error=error)
+                return
+            log.record(ref, 'ingested')
+        # Blocks when the model stage falls behind, bounding ingested-but-unprocessed items
+        await queue.put(item)
+
+    async def model_worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            ref = item['reference']
+            tS = time.time()
+            log.record(ref, 'running')
+            error = await model(opt, item)
+            timings[ref]['model'] = time.time() - tS
+            if error is None:
+                log.record(ref, 'done')
+            else:
+                log.record(ref, 'failed', stage='model', error=error)
+
+    workers = [asyncio.ensure_future(model_worker()) for _ in range(opt.model_jobs)]
+    await asyncio.gather(*[ingest_one(item) for item in items])
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+
+    return timings
+
+def report(items, timings, log, wall, slowest=10):
+    done = [item['reference'] for item in items if log.get(item['reference']) == 'done']
+    failed = [item['reference'] for item in items if log.get(item['reference']) == 'failed']
+    print(f"Processed {len(items)} items in {wall:.1f} sec: {len(done)} done, {len(failed)} failed")
+    if wall > 0:
+        print(f"Throughput: {len(done) / wall * 3600:.1f} items/hour")
+
+    durations = sorted(((sum(t.values()), ref) for ref, t in timings.items() if t), reverse=True)
+    if durations:
+        print(f"Slowest {min(slowest, len(durations))} items:")
+        for duration, ref in durations[:slowest]:
+            t = timings[ref]
+            print(f"  {ref}: {duration:.1f} sec (ingest {t.get('ingest', 0):.1f} sec, model {t.get('model', 0):.1f} sec), {log.get(ref)}")
+    for ref in failed:
+        print(f"  FAILED {ref} at {log.status[ref].get('stage')}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Batch runner for run_pipeline.py over a manifest of videos")
+    parser.add_argument('--manifest', type=str, required=True, help='Text file with one videofile[,reference] per line')
+    parser.add_argument('--data_dir', type=str, default='data/work', help='Output directory')
+    parser.add_argument('--status', type=str, default='', help='Status log (default: <data_dir>/batch_status.jsonl)')
+    parser.add_argument('--shard', type=shard_spec, default='0/1', help='Process shard i of N, as i/N with 0 <= i < N')
+    parser.add_argument('--ingest_jobs', type=int, default=4, help='Concurrent ffmpeg ingest jobs')
+    parser.add_argument('--ffmpeg_threads', type=int, default=0, help='Threads per ffmpeg transcode (0 = auto)')
+    parser.add_argument('--model_jobs', type=int, default=1, help='Concurrent model stage workers')
+    parser.add_argument('--queue_size', type=int, default=8, help='Maximum ingested items waiting for the model stage')
+    parser.add_argument('--pipeline_args', type=str, default='', help='Extra arguments passed to run_pipeline.py')
+    parser.add_argument('--retry_failed', action='store_true', help='Also rerun items recorded as failed')
+    opt = parser.parse_args()
+
+    shard, num_shards = opt.shard
+    opt.data_dir = os.path.abspath(opt.data_dir)
+    os.makedirs(opt.data_dir, exist_ok=True)
+    log = StatusLog(opt.status or os.path.join(opt.data_dir, 'batch_status.jsonl'))
+
+    items = [item for item in read_items(opt.manifest) if in_shard(item['reference'], shard, num_shards)]
+    skip = {'done'} if opt.retry_failed else {'done', 'failed'}
+    todo = [item for item in items if log.get(item['reference']) not in skip]
+    print(f"Shard {shard}/{num_shards}: {len(items)} items, {len(items) - len(todo)} already finished")
+    # Left mid-stage by a crash or kill; rerun from the start of that stage
+    for item in todo:
+        if log.get(item['reference']) in ('ingesting', 'running'):
+            print(f"  Retrying {item['reference']}, interrupted while {log.get(item['reference'])}")
+
+    tS = time.time()
+    timings = asyncio.run(run(opt, todo, log))
+    report(todo, timings, log, time.time() - tS)
+    log.close()
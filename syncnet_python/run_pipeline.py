@@ -4,18 +4,19 @@ import sys, time, os, pdb, argparse, pickle, subprocess, glob, cv2
 import numpy as np
 from shutil import rmtree
 
-import scenedetect
-from scenedetect.video_manager import VideoManager
-from scenedetect.scene_manager import SceneManager
-from scenedetect.frame_timecode import FrameTimecode
-from scenedetect.stats_manager import StatsManager
-from scenedetect.detectors import ContentDetector
-
-from scipy.interpolate import interp1d
 from scipy.io import wavfile
 from scipy import signal
 
 from detectors import S3FD
+from SyncNetInstance import SyncNetInstance
+from shot_detect import detect_shots
+from frame_bus import FrameBus, ShotConsumer, FaceDetConsumer
+from facetrack import track_shot, crop_tracks, track_and_crop_parallel, evaluate_tracks
+from track_shards import ShardWriter
+from stage_cache import StageCache
+from ingest import ingest
+from frame_store import FrameStore, frame_store_path, frame_source, write_frame_store
+from detectors.s3fd import PATH_WEIGHT
 
 # ========== ========== ========== ==========
 # # PARSE ARGS
@@ -31,6 +32,31 @@ parser.add_argument('--min_track', type=int, default=100, help='Minimum face tra
 parser.add_argument('--frame_rate', type=int, default=25, help='Frame rate')
 parser.add_argument('--num_failed_det', type=int, default=25, help='Number of missed detections allowed before tracking is stopped')
 parser.add_argument('--min_face_size', type=int, default=100, help='Minimum face size in pixels')
+parser.add_argument('--scene_detector', type=str, default='scenedetect', choices=['builtin', 'scenedetect'], help='Shot boundary detector (builtin: faster downscaled-stream detector)')
+parser.add_argument('--scene_threshold', type=float, default=30.0, help='Mean frame difference for a cut (builtin detector)')
+parser.add_argument('--scene_hist_threshold', type=float, default=0.2, help='Histogram distance for a cut (builtin detector)')
+parser.add_argument('--scene_colorspace', type=str, default='gray', choices=['gray', 'hsv'], help='Colour space of the downscaled stream (builtin detector)')
+parser.add_argument('--ffmpeg_threads', type=int, default=0, help='Threads for the ingest ffmpeg call (0 for automatic)')
+parser.add_argument('--passthrough', type=str, default='auto', choices=['auto', 'always', 'never'], help='Copy the video stream at ingest instead of re-encoding (auto: AVI input at 25 fps in a copyable codec with aligned stream start times)')
+parser.add_argument('--frame_store', action='store_true', help='Keep raw frames in one memory-mapped file in pyframes instead of JPEGs')
+parser.add_argument('--frame_store_scale', type=float, default=1.0, help='Resolution of the frame store relative to the video (face detection only when below 1)')
+parser.add_argument('--skip_ingest', action='store_true', help='Use video.avi and audio.wav already in pyavi (e.g. from run_batch.py)')
+parser.add_argument('--frame_bus', action='store_true', help='Decode video.avi once for both face and scene detection')
+parser.add_argument('--workers', type=int, default=1, help='Worker processes for shot-parallel tracking and cropping')
+parser.add_argument('--syncnet', action='store_true', help='Evaluate tracks with SyncNet in-process instead of running run_syncnet.py')
+parser.add_argument('--write_crops', action='store_true', help='Also write cropped track videos when using --syncnet')
+parser.add_argument('--initial_model', type=str, default='data/syncnet_v2.model', help='SyncNet model (with --syncnet)')
+parser.add_argument('--batch_size', type=int, default=20, help='SyncNet batch size (with --syncnet)')
+parser.add_argument('--vshift', type=int, default=15, help='Maximum shift in frames searched by SyncNet (with --syncnet)')
+parser.add_argument('--search', type=str, default='wide', choices=['narrow', 'wide'], help='Offset search method (with --syncnet)')
+parser.add_argument('--shard_dir', type=str, default='', help='Export evaluated tracks as training shards into this directory (with --syncnet)')
+parser.add_argument('--shard_crop_size', type=int, default=112, help='Width of the exported crops')
+parser.add_argument('--shard_region', type=str, default='face', choices=['face', 'mouth'], help='Export the whole face crop or its lower half')
+parser.add_argument('--facedet_batch', type=int, default=8, help='Frames per face detection batch (frame bus only)')
+parser.add_argument('--facedet_workers', type=int, default=0, help='Face detection processes fed from one decoder through shared memory (0 to disable; needs Python 3.8+)')
+parser.add_argument('--facedet_threads', type=int, default=1, help='Torch threads per face detection process')
+parser.add_argument('--facedet_device', type=str, default='cpu', help='Device of the face detection processes')
+parser.add_argument('--from_stage', type=str, default=None, choices=['ingest', 'faces', 'scenes', 'tracks', 'crops', 'syncnet'], help='Rerun this stage and every later one even if their outputs are up to date')
 opt = parser.parse_args()
 
 setattr(opt, 'avi_dir', os.path.join(opt.data_dir, 'pyavi'))
@@ -41,51 +67,6 @@ setattr(opt, 'frames_dir', os.path.join(opt.data_dir, 'pyframes'))
 
 print(f"Arguments: data_dir={opt.data_dir}, videofile={opt.videofile}, reference={opt.reference}")
 
-# ========== ========== ========== ==========
-# # FACE TRACKING
-# ========== ========== ========== ==========
-
-def track_shot(opt, scenefaces):
-    print("Starting face tracking...")
-    iouThres = 0.5
-    tracks = []
-
-    for frame_idx, framefaces in enumerate(scenefaces):
-        print(f"Processing frame {frame_idx}: Detected faces - {len(framefaces)}")
-        
-        for face in framefaces:
-            print(f"Evaluating face: {face}")
-
-            if tracks:
-                last_track_frame = tracks[-1]['frame'][-1]  # Last frame number from the last track
-                print(f"Last track frame: {last_track_frame}")
-                
-                if face['frame'] - last_track_frame <= opt.num_failed_det:
-                    last_track_face = tracks[-1]['bbox'][-1]  # Last bounding box of the last track
-                    iou = bb_intersection_over_union(face['bbox'], last_track_face)
-                    print(f"IOU with last track face: {iou}")
-
-                    if iou > iouThres:
-                        print("Linking to existing track.")
-                        tracks[-1]['frame'].append(face['frame'])
-                        tracks[-1]['bbox'].append(face['bbox'])
-                    else:
-                        print("Starting a new track due to low IOU.")
-                        tracks.append({'frame': [face['frame']], 'bbox': [face['bbox']]})
-                else:
-                    print("Starting a new track as frames are too far apart.")
-                    tracks.append({'frame': [face['frame']], 'bbox': [face['bbox']]})
-            else:
-                print("Starting a new track as no previous track is available.")
-                tracks.append({'frame': [face['frame']], 'bbox': [face['bbox']]})
-
-    print(f"Completed tracking with {len(tracks)} tracks found.")
-    return tracks
-
-
-
-
-
 # ========== ========== ========== ==========
 # # FACE DETECTION
 # ========== ========== ========== ==========
@@ -94,18 +75,28 @@ def inference_video(opt):
     print("Starting face detection...")
     DET = S3FD(device='cuda')
 
-    flist = glob.glob(os.path.join(opt.frames_dir, opt.reference, '*.jpg'))
-    flist.sort()
-    print(f"Total frames to process for face detection: {len(flist)}")
+    if opt.frame_store:
+        store = FrameStore(frame_store_path(opt))
+        frames = (store[fidx] for fidx in range(len(store)))
+        names = (f'{store.path}[{fidx}]' for fidx in range(len(store)))
+        num_frames, scale = len(store), store.scale
+    else:
+        flist = glob.glob(os.path.join(opt.frames_dir, opt.reference, '*.jpg'))
+        flist.sort()
+        frames = (cv2.imread(fname) for fname in flist)
+        names = iter(flist)
+        num_frames, scale = len(flist), 1.0
+    print(f"Total frames to process for face detection: {num_frames}")
 
     dets = []
 
-    for fidx, fname in enumerate(flist):
+    for fidx, (fname, image) in enumerate(zip(names, frames)):
         start_time = time.time()
 
-        image = cv2.imread(fname)
         image_np = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        bboxes = DET.detect_faces(image_np, conf_th=0.9, scales=[opt.facedet_scale])
+        # A downscaled store is detected at the same absolute scale; boxes are mapped back to video coordinates
+        bboxes = DET.detect_faces(image_np, conf_th=0.9, scales=[opt.facedet_scale / scale])
+        bboxes[:, :4] /= scale
 
         dets.append([])
         for bbox in bboxes:
@@ -123,64 +114,17 @@ def inference_video(opt):
 
 
 
-def bb_intersection_over_union(boxA, boxB):
-    # Unpack the bounding box coordinates
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
-
-    # Compute the area of intersection rectangle
-    interArea = max(0, xB - xA + 1) * max(0, yB - yA + 1)
-
-    # Compute the area of both the prediction and ground-truth rectangles
-    boxAArea = (boxA[2] - boxA[0] + 1) * (boxA[3] - boxA[1] + 1)
-    boxBArea = (boxB[2] - boxB[0] + 1) * (boxB[3] - boxB[1] + 1)
-
-    # Compute the intersection over union by dividing the intersection area by the sum of
-    # the prediction + ground-truth areas - the intersection area
-    iou = interArea / float(boxAArea + boxBArea - interArea)
-
-    return iou
-
-import cv2
-
-def crop_video(opt, track, output_dir):
-    # Create output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Load the video file corresponding to the track
-    video_path = os.path.join(opt.avi_dir, opt.reference, 'video.avi')
-    cap = cv2.VideoCapture(video_path)
-
-    for i, bbox in enumerate(track['bbox']):
-        # Read the video frame corresponding to the track
-        frame_num = track['frame'][i]
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-        ret, frame = cap.read()
-
-        if ret:
-            # Crop the frame using the bounding box
-            x1, y1, x2, y2 = map(int, bbox)
-            cropped_frame = frame[y1:y2, x1:x2]
-
-            # Save the cropped frame to the output directory
-            output_path = os.path.join(output_dir, f'frame_{frame_num:05d}.jpg')
-            cv2.imwrite(output_path, cropped_frame)
-
-    cap.release()
-
-
-
-
 # ========== ========== ========== ==========
 # # SCENE DETECTION
 # ========== ========== ========== ==========
 
-def scene_detect(opt):
-    print("Starting scene detection...")
-    video_manager = VideoManager([os.path.join(opt.avi_dir, opt.reference, 'video.avi')])
+def scenedetect_shots(videofile):
+    from scenedetect.video_manager import VideoManager
+    from scenedetect.scene_manager import SceneManager
+    from scenedetect.stats_manager import StatsManager
+    from scenedetect.detectors import ContentDetector
+
+    video_manager = VideoManager([videofile])
     stats_manager = StatsManager()
     scene_manager = SceneManager(stats_manager)
     scene_manager.add_detector(ContentDetector())
@@ -190,10 +134,29 @@ def scene_detect(opt):
     scene_manager.detect_scenes(frame_source=video_manager)
 
     scene_list = scene_manager.get_scene_list(video_manager.get_base_timecode())
-    savepath = os.path.join(opt.work_dir, opt.reference, 'scene.pckl')
     if not scene_list:
         scene_list = [(video_manager.get_base_timecode(), video_manager.get_current_timecode())]
 
+    return [(start.frame_num, end.frame_num) for start, end in scene_list]
+
+def scene_detect(opt):
+    print("Starting scene detection...")
+    videofile = os.path.join(opt.avi_dir, opt.reference, 'video.avi')
+    source = frame_source(opt)
+
+    if opt.scene_detector == 'builtin' and isinstance(source, FrameStore):
+        bus = FrameBus(source)
+        shots = bus.register(ShotConsumer(colorspace=opt.scene_colorspace,
+                                          threshold=opt.scene_threshold, hist_threshold=opt.scene_hist_threshold))
+        bus.run()
+        scene_list = shots.scene_list()
+    elif opt.scene_detector == 'builtin':
+        scene_list = detect_shots(videofile, colorspace=opt.scene_colorspace,
+                                  threshold=opt.scene_threshold, hist_threshold=opt.scene_hist_threshold)
+    else:
+        scene_list = scenedetect_shots(videofile)
+
+    savepath = os.path.join(opt.work_dir, opt.reference, 'scene.pckl')
     with open(savepath, 'wb') as fil:
         pickle.dump(scene_list, fil)
     
@@ -201,47 +164,205 @@ def scene_detect(opt):
     return scene_list
 
 # ========== ========== ========== ==========
-# # EXECUTE DEMO
+# # SINGLE-DECODE DETECTION
 # ========== ========== ========== ==========
 
-# ========== MAKE NEW DIRECTORIES ==========
-
-print("Creating working directory structure...")
-
-# Convert Video and Extract Frames
-print("Converting video to AVI format and extracting frames...")
-command = f"ffmpeg -y -i {opt.videofile} -qscale:v 2 -async 1 -r 25 {os.path.join(opt.avi_dir, opt.reference, 'video.avi')}"
-subprocess.call(command, shell=True)
-
-command = f"ffmpeg -y -i {os.path.join(opt.avi_dir, opt.reference, 'video.avi')} -qscale:v 2 -threads 1 -f image2 {os.path.join(opt.frames_dir, opt.reference, '%06d.jpg')}"
-subprocess.call(command, shell=True)
-
-command = f"ffmpeg -y -i {os.path.join(opt.avi_dir, opt.reference, 'video.avi')} -ac 1 -vn -acodec pcm_s16le -ar 16000 {os.path.join(opt.avi_dir, opt.reference, 'audio.wav')}"
-subprocess.call(command, shell=True)
+def detect_faces_and_scenes(opt, faces=True, scenes=True):
+    """Face and/or scene detection on one decode; a skipped one is returned as None.
+
+    Only the builtin scene detector runs on the shared decode; scenedetect
+    reads the video itself.
+    """
+    print("Starting face and scene detection on a shared decode...")
+    shared_scenes = scenes and opt.scene_detector == 'builtin'
+    bus = FrameBus(frame_source(opt))
+    if shared_scenes:
+        shots = bus.register(ShotConsumer(colorspace=opt.scene_colorspace,
+                                          threshold=opt.scene_threshold, hist_threshold=opt.scene_hist_threshold))
+    if faces:
+        facedet = bus.register(FaceDetConsumer(S3FD(device='cuda'), batch_size=opt.facedet_batch,
+                                               conf_th=0.9, scales=[opt.facedet_scale]))
+    if bus.consumers:
+        num_frames = bus.run()
+        print(f"Decoded {num_frames} frames")
+
+    dets = scene_list = None
+    if faces:
+        dets = facedet.dets
+        with open(os.path.join(opt.work_dir, opt.reference, 'faces.pckl'), 'wb') as fil:
+            pickle.dump(dets, fil)
+    if scenes:
+        scene_list = shots.scene_list() if shared_scenes else scenedetect_shots(os.path.join(opt.avi_dir, opt.reference, 'video.avi'))
+        with open(os.path.join(opt.work_dir, opt.reference, 'scene.pckl'), 'wb') as fil:
+            pickle.dump(scene_list, fil)
+        print(f"Detection completed, {len(scene_list)} scenes detected")
+
+    return dets, scene_list
+
+def load_pickle(path):
+    with open(path, 'rb') as fil:
+        return pickle.load(fil)
 
-# Face Detection
-faces = inference_video(opt)
+# ========== ========== ========== ==========
+# # EXECUTE DEMO
+# ========== ========== ========== ==========
 
-# Scene Detection
-scene = scene_detect(opt)
+# ========== STAGE CACHE ==========
 
-# Face Tracking
-alltracks = []
-for shot in scene:
-    if shot[1].frame_num - shot[0].frame_num >= opt.min_track:
-        alltracks.extend(track_shot(opt, faces[shot[0].frame_num:shot[1].frame_num]))
+# Each stage is skipped when the fingerprint of its parameters and inputs
+# matches the one its outputs on disk were made with
+cache = StageCache(os.path.join(opt.work_dir, opt.reference), ['ingest', 'faces', 'scenes', 'tracks', 'crops', 'syncnet'], opt.from_stage)
 
-# Face Track Cropping
-print("Starting video cropping for each face track...")
-vidtracks = []
-for ii, track in enumerate(alltracks):
-    vidtracks.append(crop_video(opt, track, os.path.join(opt.crop_dir, opt.reference, f'{ii:05d}')))
+videopath = os.path.join(opt.avi_dir, opt.reference, 'video.avi')
+audiopath = os.path.join(opt.avi_dir, opt.reference, 'audio.wav')
+facespath = os.path.join(opt.work_dir, opt.reference, 'faces.pckl')
+scenepath = os.path.join(opt.work_dir, opt.reference, 'scene.pckl')
+trackspath = os.path.join(opt.work_dir, opt.reference, 'tracks.pckl')
 
-# Save Results
-savepath = os.path.join(opt.work_dir, opt.reference, 'tracks.pckl')
-print(f"Saving final tracks data to {savepath}")
-with open(savepath, 'wb') as fil:
-    pickle.dump(vidtracks, fil)
+# Convert Video and Extract Frames
+if opt.skip_ingest:
+    cache.fingerprint('ingest', inputs=[videopath, audiopath])
+else:
+    cache.fingerprint('ingest', {'frame_rate': 25, 'passthrough': opt.passthrough, 'frame_store': opt.frame_store,
+                                 'frame_store_scale': opt.frame_store_scale}, inputs=[opt.videofile])
+
+framespath = frame_store_path(opt) if opt.frame_store else os.path.join(opt.frames_dir, opt.reference)
+
+if opt.skip_ingest or cache.fresh('ingest', [videopath, audiopath, framespath]):
+    print("Using the ingested video.avi and audio.wav")
+    if opt.frame_store and not os.path.exists(framespath):
+        write_frame_store(videopath, framespath, scale=opt.frame_store_scale, threads=opt.ffmpeg_threads)
+else:
+    cache.start('ingest')
+
+    print("Converting video to AVI format and extracting frames...")
+    mode = ingest(opt.videofile, videopath, audiopath, None if opt.frame_store else os.path.join(framespath, '%06d.jpg'),
+                  threads=opt.ffmpeg_threads, passthrough={'auto': 'auto', 'always': True, 'never': False}[opt.passthrough],
+                  frame_store=framespath if opt.frame_store else None, frame_store_scale=opt.frame_store_scale)
+    if mode is None:
+        sys.exit(f"Ingest of {opt.videofile} failed")
+    print(f"Ingest done ({mode})")
+
+    cache.done('ingest')
+
+# Face and Scene Detection
+cache.fingerprint('faces', {'facedet_scale': opt.facedet_scale, 'conf_th': 0.9,
+                            'frame_store_scale': opt.frame_store_scale if opt.frame_store else 1.0}, inputs=[PATH_WEIGHT], upstream=['ingest'])
+cache.fingerprint('scenes', {'frame_store': opt.frame_store, 'scene_detector': opt.scene_detector, 'scene_threshold': opt.scene_threshold,
+                             'scene_hist_threshold': opt.scene_hist_threshold, 'scene_colorspace': opt.scene_colorspace}, upstream=['ingest'])
+
+run_faces = not cache.fresh('faces', [facespath])
+run_scenes = not cache.fresh('scenes', [scenepath])
+faces = load_pickle(facespath) if not run_faces else None
+scene = load_pickle(scenepath) if not run_scenes else None
+if not (run_faces or run_scenes):
+    print("Face and scene detection are up to date")
+
+for stage in ['faces'] * run_faces + ['scenes'] * run_scenes:
+    cache.start(stage)
+
+# With --facedet_workers, face detection runs in its own processes instead of in-line
+serial_faces = run_faces and opt.facedet_workers < 1
+if run_faces and not serial_faces:
+    try:
+        # Imported here, as its shared memory frame ring needs Python 3.8
+        from parallel_facedet import detect_faces_parallel
+    except ImportError as e:
+        print(f"--facedet_workers needs multiprocessing.shared_memory (Python 3.8+); detecting faces in-line instead ({e})")
+        serial_faces = True
+if run_faces and not serial_faces:
+    print(f"Starting face detection with {opt.facedet_workers} processes...")
+    faces = detect_faces_parallel(opt, opt.facedet_workers, device=opt.facedet_device, threads=opt.facedet_threads)
+    with open(facespath, 'wb') as fil:
+        pickle.dump(faces, fil)
+    print(f"Face detection completed, results saved to {facespath}")
+
+if opt.frame_bus and (serial_faces or run_scenes):
+    dets, scene_list = detect_faces_and_scenes(opt, faces=serial_faces, scenes=run_scenes)
+    faces = dets if serial_faces else faces
+    scene = scene_list if run_scenes else scene
+else:
+    if serial_faces:
+        faces = inference_video(opt)
+    if run_scenes:
+        scene = scene_detect(opt)
+
+for stage in ['faces'] * run_faces + ['scenes'] * run_scenes:
+    cache.done(stage)
+
+# Face Tracking and Cropping
+cache.fingerprint('tracks', {'min_track': opt.min_track, 'num_failed_det': opt.num_failed_det,
+                             'min_face_size': opt.min_face_size}, upstream=['faces', 'scenes'])
+cache.fingerprint('crops', {'crop_scale': opt.crop_scale, 'frame_rate': opt.frame_rate}, upstream=['tracks'])
+
+def save_tracks(vidtracks):
+    print(f"Saving tracks data to {trackspath}")
+    with open(trackspath, 'wb') as fil:
+        pickle.dump(vidtracks, fil)
+
+run_tracks = not cache.fresh('tracks', [trackspath])
+run_crops = not opt.syncnet and not cache.fresh('crops', [os.path.join(opt.crop_dir, opt.reference)])
+
+if not run_tracks:
+    print("Face tracks are up to date")
+    vidtracks = load_pickle(trackspath)
+elif opt.workers > 1 and run_crops:
+    cache.start('tracks')
+    cache.start('crops')
+    vidtracks = track_and_crop_parallel(opt, faces, scene)
+    save_tracks(vidtracks)
+    cache.done('tracks')
+    cache.done('crops')
+    run_crops = False
+else:
+    cache.start('tracks')
+    alltracks = []
+    for shot in scene:
+        if shot[1] - shot[0] >= opt.min_track:
+            alltracks.extend(track_shot(opt, faces[shot[0]:shot[1]]))
+    vidtracks = [{'track': track, 'proc_track': track.smooth()} for track in alltracks]
+    save_tracks(vidtracks)
+    cache.done('tracks')
+
+if opt.syncnet:
+    model_inputs = [opt.initial_model] if os.path.isfile(opt.initial_model) else []
+    cache.fingerprint('syncnet', {'initial_model': opt.initial_model, 'vshift': opt.vshift, 'search': opt.search,
+                                  'crop_scale': opt.crop_scale, 'write_crops': opt.write_crops, 'shard_dir': opt.shard_dir,
+                                  'shard_crop_size': opt.shard_crop_size, 'shard_region': opt.shard_region},
+                      inputs=model_inputs, upstream=['tracks'])
+
+    outputs = [os.path.join(opt.work_dir, opt.reference, name) for name in ['speaker.pckl', 'activesd.pckl', 'offsets.txt']]
+    if cache.fresh('syncnet', outputs):
+        print("SyncNet results are up to date")
+    else:
+        cache.start('syncnet')
+
+        s = SyncNetInstance()
+        s.loadParameters(opt.initial_model)
+        print(f"Model {opt.initial_model} loaded.")
+
+        writer = ShardWriter(opt.shard_dir) if opt.shard_dir else None
+        results, speaker_conf, speaker = evaluate_tracks(opt, s, vidtracks, write_crops=opt.write_crops, writer=writer)
+        if writer is not None:
+            writer.close()
+
+        with open(os.path.join(opt.work_dir, opt.reference, 'speaker.pckl'), 'wb') as fil:
+            pickle.dump({'conf': speaker_conf, 'speaker': speaker}, fil)
+
+        with open(os.path.join(opt.work_dir, opt.reference, 'activesd.pckl'), 'wb') as fil:
+            pickle.dump([result[2] if result is not None else None for result in results], fil)
+        with open(os.path.join(opt.work_dir, opt.reference, 'offsets.txt'), 'w') as fil:
+            for ii, result in enumerate(results):
+                if result is not None:
+                    fil.write(f"{ii:05d} {int(result[0])} {float(result[1]):.3f}\n")
+
+        cache.done('syncnet')
+elif run_crops:
+    cache.start('crops')
+    print("Starting video cropping for each face track...")
+    crop_tracks(opt, vidtracks)
+    cache.done('crops')
+else:
+    print("Track crops are up to date")
 
 print("Execution completed.")
-
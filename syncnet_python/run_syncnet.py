@@ -16,6 +16,12 @@ parser.add_argument('--vshift_fine', type=int, default='15', help='Fine maximum
 parser.add_argument('--data_dir', type=str, default='data/work', help='')
 parser.add_argument('--videofile', type=str, default='', help='')
 parser.add_argument('--reference', type=str, default='', help='')
+parser.add_argument('--search', type=str, default='wide', choices=['narrow', 'wide'], help='Offset search: per-frame loop (narrow) or matrix products over all shifts (wide)')
+parser.add_argument('--drift_segment', type=int, default=0, help='Segment length in frames for drift estimation (0 to disable)')
+parser.add_argument('--store_dir', type=str, default='', help='Embedding store directory; embeddings are reused when present')
+parser.add_argument('--codec', type=str, default='', help='Embedding codec: float16, int8 or a .npz from embedding_codec.py')
+parser.add_argument('--progressive', action='store_true', help='Stop embedding once the offset is stable and confident (ignored with --drift_segment)')
+parser.add_argument('--min_conf', type=float, default='3.0', help='Confidence needed to stop early with --progressive')
 parser.add_argument('--conf_threshold', type=float, default='0.8', help='Confidence threshold for fine synchronization')
 opt = parser.parse_args()
 
@@ -27,6 +33,10 @@ setattr(opt, 'crop_dir', os.path.join(opt.data_dir, 'pycrop'))
 # ==================== LOAD MODEL AND FILE LIST ====================
 
 s = SyncNetInstance()
+if opt.store_dir:
+    s.store = EmbeddingStore(opt.store_dir)
+if opt.codec:
+    s.codec = EmbeddingCodec.load(opt.codec)
 s.loadParameters(opt.initial_model)
 print("Model %s loaded." % opt.initial_model)
 
@@ -50,24 +60,26 @@ def refine_offset_with_curve_fitting(shifts, distances):
     return offset
 
 def synchronize_video(s, opt, fname, initial_vshift, fine_vshift, conf_threshold):
-    # Initial broad synchronization
+    # Broad synchronization scores every shift up to initial_vshift in one pass
     opt.vshift = initial_vshift
-    offset_coarse, conf_coarse, dist_coarse = s.evaluate(opt, videofile=fname)
+    if opt.progressive and opt.drift_segment == 0:
+        # Rows of windows skipped by the early exit are NaN
+        offset_coarse, conf_coarse, dist_coarse, fraction = s.evaluate_progressive(opt, videofile=fname, min_conf=opt.min_conf)
+        fractions.append(fraction)
+    else:
+        offset_coarse, conf_coarse, dist_coarse = s.evaluate(opt, videofile=fname)
+
+    if opt.drift_segment > 0:
+        drifts.append(estimate_drift(dist_coarse, initial_vshift, segment=opt.drift_segment))
     
     if conf_coarse < conf_threshold:
-        # Define the narrow range around the coarse offset
-        vshift_start = int(round(offset_coarse)) - fine_vshift
-        vshift_end = int(round(offset_coarse)) + fine_vshift
-        
-        # Fine synchronization within the narrow range
-        offset_fine, conf_fine, dist_fine = s.evaluate(opt, videofile=fname, vshift_start=vshift_start, vshift_end=vshift_end)
-        
-        # Define shifts and distances for refinement
-        shifts = range(vshift_start, vshift_end + 1)
-        distances = dist_fine  # Assuming dist_fine corresponds to these shifts
+        # Refine on the same mean-distance curve, within fine_vshift of the coarse offset
+        distances = np.nanmean(dist_coarse, 0)
+        shifts = initial_vshift - np.arange(len(distances))
+        near = np.abs(shifts - offset_coarse) <= fine_vshift
         
         # Refine the offset with curve fitting
-        refined_offset = refine_offset_with_curve_fitting(shifts, distances)
+        refined_offset = refine_offset_with_curve_fitting(shifts[near], distances[near])
     else:
         refined_offset = offset_coarse
     
@@ -77,7 +89,9 @@ def synchronize_video(s, opt, fname, initial_vshift, fine_vshift, conf_threshold
 
 dists = []
 offsets = []
+drifts = []
 confidences = []
+fractions = []
 
 for idx, fname in enumerate(flist):
     print(f"Processing file {idx+1}/{len(flist)}: {fname}")
@@ -87,6 +101,8 @@ for idx, fname in enumerate(flist):
     except Exception as e:
         print(f"Error processing {fname}: {e}")
         offsets.append(None)
+        if opt.drift_segment > 0 and len(drifts) <= idx:
+            drifts.append(None)
         continue
 
 
@@ -96,4 +112,11 @@ for idx, fname in enumerate(flist):
 with open(os.path.join(opt.work_dir, opt.reference, 'activesd.pckl'), 'wb') as fil:
     pickle.dump(offsets, fil)
 
+if opt.drift_segment > 0:
+    with open(os.path.join(opt.work_dir, opt.reference, 'drift.pckl'), 'wb') as fil:
+        pickle.dump(drifts, fil)
+
+if fractions:
+    print("Embedded %.0f%% of the frames on average." % (100 * np.mean(fractions)))
+
 print("Synchronization complete. Results saved.")
@@ -1,67 +1,77 @@
 #!/usr/bin/env python3
 
-import subprocess
 import os
+import argparse
+
+from SyncNetInstance import SyncNetInstance
+from embedding_store import EmbeddingStore
+from sync_video import sync_video, frames_to_ms
+
+# ==================== DETECT, CORRECT, VERIFY ====================
+
+def detect_correct_verify(s, opt, videofile, output_file, confirm=False, mode='auto'):
+    """Detect the AV offset of videofile, write the corrected output_file and
+    verify the correction, all with one embedding pass.
+
+    Verification shifts the audio embeddings already computed for detection by
+    the applied offset and re-scores them, so the corrected file is never
+    decoded. With confirm, the written file is also embedded and evaluated.
+    """
+    im_feat, cc_feat = s.embed_file(opt, videofile)
+    offset, conf, _ = s.compute_offset(opt, im_feat, cc_feat)
+
+    result = {'offset': int(offset), 'conf': float(conf), 'applied_ms': frames_to_ms(int(offset))}
+    result['mode'] = sync_video(videofile, result['applied_ms'], output_file, mode=mode)
+    if result['mode'] is None:
+        raise RuntimeError('Correcting %s failed' % videofile)
+
+    residual, residual_conf, _ = s.verify_offset(opt, im_feat, cc_feat, offset)
+    result['residual'] = int(residual)
+    result['residual_conf'] = float(residual_conf)
+
+    if confirm:
+        confirmed, confirmed_conf, _ = s.evaluate(opt, videofile=output_file)
+        result['confirmed'] = int(confirmed)
+        result['confirmed_conf'] = float(confirmed_conf)
+
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Desynchronize a video, then detect, correct and verify the offset")
+    parser.add_argument('--initial_model', type=str, default="data/syncnet_v2.model", help='')
+    parser.add_argument('--batch_size', type=int, default='20', help='')
+    parser.add_argument('--vshift', type=int, default='50', help='Maximum shift in frames')
+    parser.add_argument('--search', type=str, default='wide', choices=['narrow', 'wide'], help='Offset search: per-frame loop (narrow) or matrix products over all shifts (wide)')
+    parser.add_argument('--data_dir', type=str, default='data', help='')
+    parser.add_argument('--videofile', type=str, default='data/example.avi', help='')
+    parser.add_argument('--delay_ms', type=float, default=1000, help='Audio delay applied to create the out-of-sync video')
+    parser.add_argument('--mode', type=str, default='auto', choices=['auto', 'copy', 'reencode'], help='Stream-copy, re-encode, or copy with re-encode fallback')
+    parser.add_argument('--confirm', action='store_true', help='Also evaluate the corrected file')
+    parser.add_argument('--store_dir', type=str, default='', help='Embedding store directory; embeddings are reused when present')
+    opt = parser.parse_args()
+
+    setattr(opt, 'tmp_dir', os.path.join(opt.data_dir, 'work', 'pytmp'))
+    setattr(opt, 'reference', 'example_sequence')
+
+    # MKV carries per-stream start times, so both shifts below are stream copies
+    out_of_sync_video = os.path.join(opt.data_dir, 'example_out_of_sync.mkv')
+    back_in_sync_video = os.path.join(opt.data_dir, 'example_back_in_sync.mkv')
+
+    s = SyncNetInstance()
+    if opt.store_dir:
+        s.store = EmbeddingStore(opt.store_dir)
+    s.loadParameters(opt.initial_model)
+    print("Model %s loaded." % opt.initial_model)
 
-# Define paths and filenames
-data_dir = 'data'
-original_video = os.path.join(data_dir, 'example.avi')
-out_of_sync_video = os.path.join(data_dir, 'example_out_of_sync.avi')
-back_in_sync_video = os.path.join(data_dir, 'example_back_in_sync.avi')
-
-try:
-    # Step 1: Run SyncNet on the original video
-    print("Running SyncNet on original video...")
-    result = subprocess.run(
-        ['python3', 'run_syncnet.py', '--videofile', original_video, '--reference', 'example'],
-        capture_output=True, text=True
-    )
-    print("Output from SyncNet on original video:", result.stdout)
-    print("Errors (if any):", result.stderr)
-
-    # Step 2: Create an out-of-sync version of the video
     print("Creating out-of-sync video...")
-    delay_ms = 1000  # Delay in milliseconds (1000ms = 1s)
-    ffmpeg_cmd = [
-        'ffmpeg', '-y', '-i', original_video,
-        '-filter_complex', f'[0:a]adelay={delay_ms}|{delay_ms}[aud]',
-        '-map', '0:v', '-map', '[aud]',
-        '-c:v', 'copy', '-c:a', 'aac',
-        out_of_sync_video
-    ]
-    result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-    print("Output from FFmpeg:", result.stdout)
-    print("Errors (if any):", result.stderr)
-
-    # Step 3: Run SyncNet on the out-of-sync video
-    print("Running SyncNet on out-of-sync video...")
-    result = subprocess.run(
-        ['python3', 'run_syncnet.py', '--videofile', out_of_sync_video, '--reference', 'example_out_of_sync'],
-        capture_output=True, text=True
-    )
-    print("Output from SyncNet on out-of-sync video:", result.stdout)
-    print("Errors (if any):", result.stderr)
-
-    # Step 4: Synchronize the audio using sync_video.py with .pckl format
-    print("Synchronizing the out-of-sync video...")
-    results_file = os.path.join(data_dir, 'work', 'pywork', 'example_out_of_sync', 'activesd.pckl')  # Updated to .pckl
-    result = subprocess.run(
-        ['python3', 'sync_video.py', '--videofile', out_of_sync_video, '--resultsfile', results_file, '--outputfile', back_in_sync_video],
-        capture_output=True, text=True
-    )
-    print("Output from sync_video.py:", result.stdout)
-    print("Errors (if any):", result.stderr)
-
-    # Step 5: Run SyncNet on the synchronized video
-    print("Running SyncNet on synchronized video...")
-    result = subprocess.run(
-        ['python3', 'run_syncnet.py', '--videofile', back_in_sync_video, '--reference', 'example_back_in_sync'],
-        capture_output=True, text=True
-    )
-    print("Output from SyncNet on synchronized video:", result.stdout)
-    print("Errors (if any):", result.stderr)
+    if sync_video(opt.videofile, opt.delay_ms, out_of_sync_video, mode=opt.mode) is None:
+        raise SystemExit('Could not create %s' % out_of_sync_video)
 
-    print("All steps completed.")
+    print("Detecting, correcting and verifying...")
+    result = detect_correct_verify(s, opt, out_of_sync_video, back_in_sync_video, confirm=opt.confirm, mode=opt.mode)
 
-except Exception as e:
-    print("An error occurred:", e)
+    print('Detected offset: \t%d frames (%.1f ms applied, conf %.3f, %s)' % (result['offset'], result['applied_ms'], result['conf'], result['mode']))
+    print('Residual offset: \t%d frames (conf %.3f)' % (result['residual'], result['residual_conf']))
+    if opt.confirm:
+        print('Confirmed offset: \t%d frames (conf %.3f)' % (result['confirmed'], result['confirmed_conf']))
+    print("All steps completed.")
@@ -3,11 +3,15 @@
 
 import torch
 import numpy
-import time, pdb, argparse, subprocess, pickle, os, glob
+import time, pdb, argparse, subprocess, pickle, os, glob, collections
 import cv2
 
+from concurrent.futures import ThreadPoolExecutor
 from scipy import signal
 
+from frame_bus import FrameBus, FrameConsumer
+from frame_store import frame_source
+
 # ==================== PARSE ARGUMENT ====================
 
 parser = argparse.ArgumentParser(description = "SyncNet");
@@ -15,6 +19,10 @@ parser.add_argument('--data_dir', 	type=str, default='data/work', help='');
 parser.add_argument('--videofile', 	type=str, default='', help='');
 parser.add_argument('--reference', 	type=str, default='', help='');
 parser.add_argument('--frame_rate', type=int, default=25, help='Frame rate');
+parser.add_argument('--start', 		type=float, default=0, help='Render from this time in seconds');
+parser.add_argument('--end', 		type=float, default=0, help='Render up to this time in seconds (0 for the end of the video)');
+parser.add_argument('--workers', 	type=int, default=4, help='Threads drawing overlays');
+parser.add_argument('--frame_store', action='store_true', help='Read frames from the full-resolution frame store in pyframes');
 opt = parser.parse_args();
 
 setattr(opt,'avi_dir',os.path.join(opt.data_dir,'pyavi'))
@@ -31,15 +39,15 @@ with open(os.path.join(opt.work_dir,opt.reference,'tracks.pckl'), 'rb') as fil:
 with open(os.path.join(opt.work_dir,opt.reference,'activesd.pckl'), 'rb') as fil:
     dists = pickle.load(fil, encoding='latin1')
 
-flist = glob.glob(os.path.join(opt.frames_dir,opt.reference,'*.jpg'))
-flist.sort()
-
 # ==================== SMOOTH FACES ====================
 
-faces = [[] for i in range(len(flist))]
+faces = collections.defaultdict(list)
 
 for tidx, track in enumerate(tracks):
 
+	if dists[tidx] is None:
+		continue
+
 	mean_dists 	=  numpy.mean(numpy.stack(dists[tidx],1),1)
 	minidx 		= numpy.argmin(mean_dists,0)
 	minval 		= mean_dists[minidx] 
@@ -50,39 +58,74 @@ for tidx, track in enumerate(tracks):
 	fconf   = numpy.median(mean_dists) - fdist
 	fconfm  = signal.medfilt(fconf,kernel_size=9)
 
-	for fidx, frame in enumerate(track['track']['frame'].tolist()) :
+	for fidx, frame in enumerate(track['track']['frame'].tolist()[:len(fconfm)]) :
 		faces[frame].append({'track': tidx, 'conf':fconfm[fidx], 's':track['proc_track']['s'][fidx], 'x':track['proc_track']['x'][fidx], 'y':track['proc_track']['y'][fidx]})
 
-# ==================== ADD DETECTIONS TO VIDEO ====================
-
-first_image = cv2.imread(flist[0])
+# ==================== RENDERER ====================
 
-fw = first_image.shape[1]
-fh = first_image.shape[0]
+def draw_faces(image, faces):
 
-fourcc = cv2.VideoWriter_fourcc(*'XVID')
-vOut = cv2.VideoWriter(os.path.join(opt.avi_dir,opt.reference,'video_only.avi'), fourcc, opt.frame_rate, (fw,fh))
-
-for fidx, fname in enumerate(flist):
-
-	image = cv2.imread(fname)
-
-	for face in faces[fidx]:
+	for face in faces:
 
 		clr = max(min(face['conf']*25,255),0)
 
 		cv2.rectangle(image,(int(face['x']-face['s']),int(face['y']-face['s'])),(int(face['x']+face['s']),int(face['y']+face['s'])),(0,clr,255-clr),3)
 		cv2.putText(image,'Track %d, Conf %.3f'%(face['track'],face['conf']), (int(face['x']-face['s']),int(face['y']-face['s'])),cv2.FONT_HERSHEY_SIMPLEX,0.5,(255,255,255),2)
 
-	vOut.write(image)
+	return image
+
+class OverlayRenderer(FrameConsumer):
+	"""Draw overlays on a thread pool and pipe the frames, in order, into one
+	ffmpeg process that encodes them and muxes the matching audio slice.
+
+	At most 2 * workers frames are in flight, so memory stays bounded when the
+	encoder is the bottleneck.
+	"""
+
+	def __init__(self, faces, audiofile, output_file, frame_rate=25, start_time=0, duration=None, workers=4):
+		self.faces 		= faces
+		self.audiofile 	= audiofile
+		self.output_file = output_file
+		self.frame_rate = frame_rate
+		self.start_time = start_time
+		self.duration 	= duration
+		self.workers 	= workers
+
+	def start(self, width, height, fps):
+		audio = ['-ss', '%.3f'%self.start_time] + (['-t', '%.3f'%self.duration] if self.duration else []) + ['-i', self.audiofile]
+		command = ['ffmpeg', '-y', '-v', 'error',
+				   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '%dx%d'%(width,height), '-r', str(self.frame_rate), '-i', '-'] + audio + [
+				   '-map', '0:v', '-map', '1:a', '-c:v', 'mpeg4', '-qscale:v', '2', '-c:a', 'pcm_s16le', '-shortest', self.output_file]
+		self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+		self.pool 	 = ThreadPoolExecutor(max_workers=self.workers)
+		self.pending = collections.deque()
+
+	def consume(self, idx, frame, window):
+		# Decoded frames are fresh arrays and are drawn on in place; frame store views are read-only
+		if not frame.flags.writeable:
+			frame = frame.copy()
+		self.pending.append(self.pool.submit(draw_faces, frame, self.faces.get(idx, [])))
+		while len(self.pending) > 2*self.workers or (self.pending and self.pending[0].done()):
+			self.encoder.stdin.write(self.pending.popleft().result().tobytes())
+
+	def finish(self):
+		while self.pending:
+			self.encoder.stdin.write(self.pending.popleft().result().tobytes())
+		self.pool.shutdown()
+		self.encoder.stdin.close()
+		self.encoder.wait()
 
-	print('Frame %d'%fidx)
-
-vOut.release()
+# ==================== ADD DETECTIONS TO VIDEO ====================
 
-# ========== COMBINE AUDIO AND VIDEO FILES ==========
+tS = time.time()
 
-command = ("ffmpeg -y -i %s -i %s -c:v copy -c:a copy %s" % (os.path.join(opt.avi_dir,opt.reference,'video_only.avi'),os.path.join(opt.avi_dir,opt.reference,'audio.wav'),os.path.join(opt.avi_dir,opt.reference,'video_out.avi'))) #-async 1 
-output = subprocess.call(command, shell=True, stdout=None)
+start_frame = int(round(opt.start*opt.frame_rate))
+end_frame 	= int(round(opt.end*opt.frame_rate)) if opt.end > 0 else None
 
+bus = FrameBus(frame_source(opt), start=start_frame, end=end_frame)
+bus.register(OverlayRenderer(faces, os.path.join(opt.avi_dir,opt.reference,'audio.wav'), os.path.join(opt.avi_dir,opt.reference,'video_out.avi'),
+							 frame_rate=opt.frame_rate, start_time=start_frame/float(opt.frame_rate),
+							 duration=(end_frame-start_frame)/float(opt.frame_rate) if end_frame is not None else None, workers=opt.workers))
+num_frames = bus.run()
 
+print('Rendered %d frames in %.3f sec.'%(num_frames,time.time()-tS))
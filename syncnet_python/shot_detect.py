@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+# ========== ========== ========== ==========
+# # SHOT BOUNDARY DETECTION
+# ========== ========== ========== ==========
+
+class ShotDetector(object):
+    """Content-based cut detector working on blocks of small frames.
+
+    Frames are fed with `update` as (N, H, W) gray or (N, H, W, 3) HSV uint8
+    blocks. For every frame the mean absolute difference to the previous frame
+    and the L1 distance between their intensity histograms are computed for the
+    whole block at once. A cut is declared where both exceed their thresholds.
+    """
+
+    def __init__(self, threshold=30.0, hist_threshold=0.2, min_scene_len=15, bins=32):
+        self.threshold = threshold
+        self.hist_threshold = hist_threshold
+        self.min_scene_len = min_scene_len
+        self.bins = bins
+        self.num_frames = 0
+        self._last = None
+        self._last_hist = None
+        self._diffs = []
+        self._hdiffs = []
+
+    def _histograms(self, block):
+        # Histogram of the luma (gray) or value (HSV) channel of every frame in one bincount
+        chan = block[..., 2] if block.ndim == 4 else block
+        n = chan.shape[0]
+        q = (chan.reshape(n, -1).astype(np.int64) * self.bins) >> 8
+        q += (np.arange(n) * self.bins)[:, None]
+        hist = np.bincount(q.ravel(), minlength=n * self.bins).reshape(n, self.bins)
+        return hist.astype(np.float32) / chan[0].size
+
+    def update(self, frames):
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return
+
+        hists = self._histograms(frames)
+
+        if self._last is None:
+            prev = np.concatenate([frames[:1], frames[:-1]])
+            prev_hists = np.concatenate([hists[:1], hists[:-1]])
+        else:
+            prev = np.concatenate([self._last[None], frames[:-1]])
+            prev_hists = np.concatenate([self._last_hist[None], hists[:-1]])
+
+        diff = np.abs(frames.astype(np.int16) - prev.astype(np.int16))
+        self._diffs.append(diff.reshape(len(frames), -1).mean(axis=1).astype(np.float32))
+        self._hdiffs.append(0.5 * np.abs(hists - prev_hists).sum(axis=1))
+
+        self._last = frames[-1].copy()
+        self._last_hist = hists[-1]
+        self.num_frames += len(frames)
+
+    def cuts(self):
+        if not self._diffs:
+            return []
+        diffs = np.concatenate(self._diffs)
+        hdiffs = np.concatenate(self._hdiffs)
+        candidates = np.flatnonzero((diffs >= self.threshold) & (hdiffs >= self.hist_threshold))
+
+        cuts = []
+        last = 0
+        for cut in candidates.tolist():
+            if cut - last >= self.min_scene_len:
+                cuts.append(cut)
+                last = cut
+        return cuts
+
+    def scene_list(self):
+        """Return [(start, end)] frame numbers, end exclusive, covering the whole video."""
+        bounds = [0] + self.cuts() + [self.num_frames]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def detect_shots(videofile, size=(128, 72), colorspace='gray', block_size=250, threads=0, **kwargs):
+    """Run ShotDetector on a downscaled raw stream decoded by ffmpeg.
+
+    Extra keyword arguments are passed to ShotDetector. Raises RuntimeError
+    with ffmpeg's error output if decoding fails.
+    """
+    w, h = size
+    pix_fmt = 'gray' if colorspace == 'gray' else 'bgr24'
+    channels = 1 if colorspace == 'gray' else 3
+    frame_bytes = w * h * channels
+
+    command = ['ffmpeg', '-v', 'error', '-threads', str(threads), '-i', videofile,
+               '-an', '-sn', '-vf', 'scale=%d:%d:flags=area' % (w, h),
+               '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-']
+
+    detector = ShotDetector(**kwargs)
+    # stderr goes to a file, so a chatty ffmpeg cannot block on a full pipe
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=err, bufsize=frame_bytes * block_size)
+        try:
+            while True:
+                buf = proc.stdout.read(frame_bytes * block_size)
+                n = len(buf) // frame_bytes
+                if n == 0:
+                    break
+                block = np.frombuffer(buf, np.uint8, n * frame_bytes)
+                if channels == 1:
+                    block = block.reshape(n, h, w)
+                else:
+                    # cvtColor is per pixel, so the whole block converts as one tall image
+                    block = cv2.cvtColor(block.reshape(n * h, w, 3), cv2.COLOR_BGR2HSV).reshape(n, h, w, 3)
+                detector.update(block)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        err.seek(0)
+        stderr = err.read().decode('utf-8', 'replace')[-2000:]
+
+    if returncode != 0:
+        raise RuntimeError('ffmpeg failed on %s: %s' % (videofile, stderr))
+
+    return detector.scene_list()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+
+from embedding_store import file_hash
+
+# ==================== STAGE CACHE ====================
+
+class StageCache(object):
+    """Fingerprints of pipeline stages whose outputs are already on disk.
+
+    A stage's fingerprint hashes its parameters, the content of its input
+    files and the fingerprints of the stages it depends on, so a change
+    anywhere upstream changes every fingerprint downstream of it. stages.json
+    maps each completed stage to the fingerprint it ran with; a stage is
+    skipped when that matches and its outputs exist.
+
+    Stages from `from_stage` on (in the order of `stages`) always rerun. A
+    stage's entry is dropped before it runs and written back only after its
+    outputs are, so an interrupted stage is never taken as complete.
+    """
+
+    MANIFEST = 'stages.json'
+
+    def __init__(self, root, stages, from_stage=None):
+        self.root = root
+        self.stages = list(stages)
+        self.forced = set(self.stages[self.stages.index(from_stage):]) if from_stage else set()
+        self.fingerprints = {}
+
+        os.makedirs(root, exist_ok=True)
+        self.manifest = {'stages': {}, 'files': {}}
+        if os.path.exists(os.path.join(root, self.MANIFEST)):
+            with open(os.path.join(root, self.MANIFEST)) as fil:
+                self.manifest = json.load(fil)
+
+    def content_hash(self, path):
+        """file_hash, reused while the file's size and mtime are unchanged."""
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        cached = self.manifest['files'].get(os.path.abspath(path))
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        digest = file_hash(path)
+        self.manifest['files'][os.path.abspath(path)] = [stamp, digest]
+        return digest
+
+    def fingerprint(self, stage, params=None, inputs=(), upstream=()):
+        h = hashlib.sha1(json.dumps({'stage': stage, 'params': params or {}}, sort_keys=True).encode())
+        for path in inputs:
+            h.update(self.content_hash(path).encode())
+        for name in upstream:
+            h.update(self.fingerprints[name].encode())
+        self.fingerprints[stage] = h.hexdigest()
+        return self.fingerprints[stage]
+
+    def fresh(self, stage, outputs=()):
+        return (stage not in self.forced
+                and self.manifest['stages'].get(stage) == self.fingerprints[stage]
+                and all(os.path.exists(path) for path in outputs))
+
+    def start(self, stage):
+        self.manifest['stages'].pop(stage, None)
+        self._write()
+
+    def done(self, stage):
+        self.manifest['stages'][stage] = self.fingerprints[stage]
+        self._write()
+
+    def _write(self):
+        tmp = os.path.join(self.root, self.MANIFEST + '.tmp')
+        with open(tmp, 'w') as fil:
+            json.dump(self.manifest, fil, indent=1, sort_keys=True)
+            fil.flush()
+            os.fsync(fil.fileno())
+        os.replace(tmp, os.path.join(self.root, self.MANIFEST))
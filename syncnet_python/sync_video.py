@@ -1,34 +1,209 @@
 #!/usr/bin/env python3
 
+import os
 import subprocess
 import argparse
+import pickle
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# SyncNet offsets are counted in frames of the 25 fps video written by the pipeline
+SYNCNET_FRAME_RATE = 25
+
+# Containers that carry per-stream start times, so a shift can be applied to
+# stream-copied packets. Anything else (e.g. AVI) falls back to re-encoding.
+COPY_CONTAINERS = {'.mp4', '.m4v', '.mov', '.mkv'}
+
+# ==================== OFFSET CORRECTION ====================
+
+def frames_to_ms(offset, frame_rate=SYNCNET_FRAME_RATE):
+    return offset * 1000.0 / frame_rate
+
+def _copy_command(video_file, offset_ms, output_file):
+    """Shift the audio against the video by moving stream start times only.
+
+    The input is opened twice: the audio is mapped from one copy and the
+    video from the other, and -itsoffset delays whichever stream has to start
+    later. Nothing is decoded, and the shift keeps full millisecond precision.
+    """
+    shift = ['-itsoffset', '%.6f' % (abs(offset_ms) / 1000.0)]
+    if offset_ms > 0:
+        inputs = ['-i', video_file] + shift + ['-i', video_file]
+    else:
+        inputs = shift + ['-i', video_file, '-i', video_file]
+    return ['ffmpeg', '-y', '-v', 'error'] + inputs + ['-map', '0:v', '-map', '1:a', '-c', 'copy', output_file]
+
+def _reencode_command(video_file, offset_ms, output_file):
+    if offset_ms > 0:
+        shift = 'adelay=delays=%.3f:all=1' % offset_ms
+    else:
+        shift = 'atrim=start=%.6f,asetpts=PTS-STARTPTS' % (-offset_ms / 1000.0)
+    return ['ffmpeg', '-y', '-v', 'error', '-i', video_file,
+            '-filter_complex', f'[0:a]{shift}[aud]',
+            '-map', '0:v', '-map', '[aud]',
+            '-c:v', 'copy', '-c:a', 'aac',
+            output_file]
+
+def sync_video(video_file, offset_ms, output_file, mode='auto'):
+    """Correct an audio offset, given in milliseconds (positive to delay audio).
+
+    mode 'copy' only retimes streams, 'reencode' runs the audio through
+    adelay/atrim, and 'auto' stream-copies whenever the output container can
+    express the shift and falls back to re-encoding if ffmpeg rejects it.
+    Returns the mode that produced the output, or None on failure.
+    """
+    logging.debug(f"Syncing video: {video_file} with offset: {offset_ms:.3f} ms to {output_file}")
+
+    if offset_ms == 0:
+        attempts = [('copy', ['ffmpeg', '-y', '-v', 'error', '-i', video_file, '-c', 'copy', output_file])]
+    else:
+        attempts = []
+        if mode in ('auto', 'copy') and os.path.splitext(output_file)[1].lower() in COPY_CONTAINERS:
+            attempts.append(('copy', _copy_command(video_file, offset_ms, output_file)))
+        if mode in ('auto', 'reencode'):
+            attempts.append(('reencode', _reencode_command(video_file, offset_ms, output_file)))
+
+    for used, ffmpeg_cmd in attempts:
+        logging.debug(f"Running FFmpeg command: {' '.join(ffmpeg_cmd)}")
+        process = subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode == 0:
+            logging.info(f"Video synchronization completed successfully ({used}).")
+            return used
+        logging.warning(f"FFmpeg {used} correction failed for {video_file}: {process.stderr.strip()}")
+
+    logging.error(f"Error during synchronization of {video_file}")
+    return None
+
+def sync_audio(video_file, offset_ms, output_file, mode='auto'):
+    """Kept for existing callers; same as sync_video."""
+    return sync_video(video_file, offset_ms, output_file, mode=mode)
+
+# ==================== RESULTS ====================
+
+def load_offsets(results_file):
+    """Per-track (offset in frames, confidence) from a results file.
+
+    Reads offsets.txt written by run_pipeline.py --syncnet, or activesd.pckl
+    written by run_syncnet.py, which holds offsets without confidences.
+    Failed tracks, and the distance matrices run_pipeline.py keeps in its own
+    activesd.pckl, are skipped.
+    """
+    if results_file.endswith('.txt'):
+        with open(results_file) as fil:
+            return [(float(offset), float(conf)) for _, offset, conf in (line.split() for line in fil if line.strip())]
+    with open(results_file, 'rb') as fil:
+        offsets = pickle.load(fil)
+    return [(float(offset), None) for offset in offsets if offset is not None and np.ndim(offset) == 0]
+
+def results_offset_ms(results_file, frame_rate=SYNCNET_FRAME_RATE):
+    """The offset to apply for a video: the most confident track's, or the median over tracks."""
+    offsets = load_offsets(results_file)
+    if not offsets:
+        return None
+    if offsets[0][1] is not None:
+        offset = max(offsets, key=lambda item: item[1])[0]
+    else:
+        values = sorted(offset for offset, _ in offsets)
+        offset = values[len(values) // 2]
+    return frames_to_ms(offset, frame_rate)
+
+def sync_videos(jobs, mode='auto', workers=4):
+    """Correct many files in one process.
+
+    `jobs` are (video_file, offset_ms or results file, output_file) tuples.
+    Stream copies are I/O bound, so several ffmpeg processes run at once.
+    Returns the mode used for every job, None where it failed or had no offset.
+    """
+    def run(job):
+        video_file, offset, output_file = job
+        if isinstance(offset, str):
+            offset = results_offset_ms(offset)
+            if offset is None:
+                logging.error(f"No usable offset for {video_file}")
+                return None
+        return sync_video(video_file, offset, output_file, mode=mode)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, jobs))
+
+def read_jobs(path):
+    """Batch file: one `videofile,offset_ms|resultsfile,outputfile` per line."""
+    jobs = []
+    with open(path) as fil:
+        for line in fil:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            video_file, offset, output_file = [field.strip() for field in line.split(',')]
+            try:
+                offset = float(offset)
+            except ValueError:
+                pass
+            jobs.append((video_file, offset, output_file))
+    return jobs
+
+# ==================== DRIFT CORRECTION ====================
+
+def sync_video_drift(video_file, drift, output_file, fps=SYNCNET_FRAME_RATE):
+    """Apply a time-varying correction from SyncNetInstance.estimate_drift output.
+
+    The offset is modelled as intercept + drift_rate * t frames. The audio is
+    first shifted by the intercept, then time-stretched with atempo so that the
+    correction grows linearly with the drift rate. Stretching always needs a
+    re-encode.
+    """
+    delay = drift['intercept'] / fps  # Seconds to delay the audio at t = 0
+    tempo = 1.0 - drift['drift_rate'] / fps  # Input audio seconds per output second
+    logging.debug(f"Drift correction for {video_file}: delay {delay:.4f}s, tempo {tempo:.6f}")
+
+    if delay >= 0:
+        shift = f'adelay=delays={delay * 1000:.3f}:all=1'
+    else:
+        shift = f'atrim=start={-delay:.6f},asetpts=PTS-STARTPTS'
 
-def sync_audio(video_file, offset_ms, output_file):
-    # Build the ffmpeg command to delay the audio
     ffmpeg_cmd = [
         'ffmpeg', '-y', '-i', video_file,
-        '-filter_complex', f'[0:a]adelay={offset_ms}|{offset_ms}[aud]',
+        '-filter_complex', f'[0:a]{shift},atempo={tempo:.6f}[aud]',
         '-map', '0:v', '-map', '[aud]',
         '-c:v', 'copy', '-c:a', 'aac',
         output_file
     ]
 
-    # Execute the ffmpeg command and capture output
-    print("Running FFmpeg command...")
-    process = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+    logging.debug(f"Running FFmpeg command: {' '.join(ffmpeg_cmd)}")
 
-    # Print FFmpeg output and errors for troubleshooting
-    print("FFmpeg Output:")
-    print(process.stdout)
-    print("FFmpeg Errors:")
-    print(process.stderr)
+    try:
+        subprocess.run(ffmpeg_cmd, check=True)
+        logging.info("Drift correction completed successfully.")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error during drift correction: {e}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Synchronize audio with video")
-    parser.add_argument('--videofile', type=str, required=True, help='Path to the input video file')
-    parser.add_argument('--offset', type=int, required=True, help='Audio offset in milliseconds (positive to delay audio)')
-    parser.add_argument('--outputfile', type=str, required=True, help='Path to the output synchronized video file')
+    parser.add_argument('--videofile', type=str, default='', help='Path to the input video file')
+    parser.add_argument('--offset', type=float, default=None, help='Audio offset in milliseconds (positive to delay audio)')
+    parser.add_argument('--resultsfile', type=str, default='', help='Take the offset from activesd.pckl or offsets.txt instead')
+    parser.add_argument('--driftfile', type=str, default='', help='Apply a drift correction from drift.pckl instead')
+    parser.add_argument('--track', type=int, default=0, help='Entry of the drift file to apply')
+    parser.add_argument('--outputfile', type=str, default='', help='Path to the output synchronized video file')
+    parser.add_argument('--mode', type=str, default='auto', choices=['auto', 'copy', 'reencode'], help='Stream-copy, re-encode, or copy with re-encode fallback')
+    parser.add_argument('--batch', type=str, default='', help='File with one videofile,offset_ms|resultsfile,outputfile per line')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent ffmpeg processes in batch mode')
     args = parser.parse_args()
 
-    # Call the sync function
-    sync_audio(args.videofile, args.offset, args.outputfile)
+    if args.batch:
+        modes = sync_videos(read_jobs(args.batch), mode=args.mode, workers=args.workers)
+        logging.info(f"Corrected {sum(m is not None for m in modes)}/{len(modes)} files, {modes.count('copy')} by stream copy")
+    elif args.driftfile:
+        with open(args.driftfile, 'rb') as fil:
+            drift = pickle.load(fil)[args.track]
+        sync_video_drift(args.videofile, drift, args.outputfile)
+    else:
+        if args.offset is None and not args.resultsfile:
+            parser.error('one of --offset, --resultsfile, --driftfile or --batch is required')
+        offset = args.offset if args.offset is not None else results_offset_ms(args.resultsfile)
+        if offset is None:
+            raise SystemExit(f"No usable offset in {args.resultsfile}; {args.videofile} left unchanged")
+        sync_video(args.videofile, offset, args.outputfile, mode=args.mode)
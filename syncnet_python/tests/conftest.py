@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules are scripts importing each other from syncnet_python/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
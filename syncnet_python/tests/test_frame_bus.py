@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from frame_bus import FrameBus, TrackArrayConsumer, crop_face
+from frame_store import FrameStoreWriter, FrameStore
+from facetrack import Track
+
+
+def make_store(path, num_frames=20, height=120, width=160):
+    with FrameStoreWriter(str(path), height, width) as writer:
+        writer.write(np.full((num_frames, height, width, 3), 50, dtype=np.uint8))
+    return FrameStore(str(path))
+
+
+def make_track(start, length, box=(40, 30, 80, 70)):
+    track = Track.from_arrays(np.arange(start, start + length), np.tile(box, (length, 1)))
+    return {'track': track, 'proc_track': track.smooth()}
+
+
+@pytest.mark.parametrize('s', [0, -3, float('nan')])
+def test_crop_face_rejects_degenerate_size(s):
+    with pytest.raises(ValueError):
+        crop_face(np.zeros((120, 160, 3), np.uint8), 80, 60, s, 0.4)
+
+
+def test_crop_face_rejects_box_outside_frame():
+    with pytest.raises(ValueError):
+        crop_face(np.zeros((120, 160, 3), np.uint8), 1000, 1000, 10, 0.4)
+
+
+@pytest.mark.parametrize('length', range(1, 7))
+def test_short_track_is_smoothed_and_cropped(tmp_path, length):
+    track = make_track(3, length)
+    assert (track['proc_track']['s'] > 0).all()
+
+    got = {}
+    bus = FrameBus(make_store(tmp_path / 'frames.u8'))
+    bus.register(TrackArrayConsumer([track], got.__setitem__, min_frames=1))
+    bus.run()
+
+    assert got[0].shape == (length, 224, 224, 3)
+
+
+def test_degenerate_track_is_dropped_without_stopping_the_others(tmp_path):
+    bad = make_track(0, 6)
+    bad['proc_track']['s'][:] = 0
+    good = make_track(2, 10)
+
+    got = {}
+    bus = FrameBus(make_store(tmp_path / 'frames.u8'))
+    consumer = bus.register(TrackArrayConsumer([bad, good], got.__setitem__))
+    assert bus.run() == 20
+
+    assert consumer.dropped == {0}
+    assert list(got) == [1] and got[1].shape == (10, 224, 224, 3)
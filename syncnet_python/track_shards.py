@@ -0,0 +1,157 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+import os
+import json
+import glob
+import fcntl
+import random
+import numpy
+
+# ==================== SHARD WRITER ====================
+
+class ShardWriter(object):
+    """Pack per-track training samples into large, sequentially written shard files.
+
+    A record is the raw bytes of its arrays (crops, PCM, MFCC, ...), each padded
+    to ALIGN bytes, appended to the current `shard-NNNNN.bin`. A new shard is
+    started once the current one exceeds shard_bytes. index.jsonl gets one line
+    per record with its shard, byte offset, array layout and metadata.
+
+    Records are appended under an exclusive lock on the directory, so several
+    pipeline processes can export into the same shards. The data is fsynced
+    before its index line is written, so the index never points past the data.
+    """
+
+    ALIGN = 64
+    INDEX = 'index.jsonl'
+
+    def __init__(self, root, shard_bytes=1 << 30):
+        self.root = root
+        self.shard_bytes = shard_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = open(os.path.join(root, '.lock'), 'a')
+
+    def _current_shard(self):
+        shards = sorted(glob.glob(os.path.join(self.root, 'shard-*.bin')))
+        if not shards:
+            return 0
+        last = int(os.path.basename(shards[-1])[6:11])
+        return last + 1 if os.path.getsize(shards[-1]) >= self.shard_bytes else last
+
+    def add(self, key, meta=None, **arrays):
+        layout = {}
+        chunks = []
+        size = 0
+        for name, array in arrays.items():
+            data = numpy.ascontiguousarray(array)
+            layout[name] = [size, list(data.shape), data.dtype.str]
+            chunks.append(data.tobytes())
+            pad = -data.nbytes % self.ALIGN
+            if pad:
+                chunks.append(b'\0' * pad)
+            size += data.nbytes + pad
+
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            shard = self._current_shard()
+            with open(os.path.join(self.root, 'shard-%05d.bin' % shard), 'ab') as fil:
+                offset = fil.tell()
+                for chunk in chunks:
+                    fil.write(chunk)
+                fil.flush()
+                os.fsync(fil.fileno())
+
+            entry = {'key': key, 'shard': shard, 'offset': offset, 'size': size, 'arrays': layout, 'meta': meta or {}}
+            with open(os.path.join(self.root, self.INDEX), 'a') as fil:
+                fil.write(json.dumps(entry) + '\n')
+                fil.flush()
+                os.fsync(fil.fileno())
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def close(self):
+        self._lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# ==================== SHARD READER ====================
+
+class ShardReader(object):
+    """Random access by key or position, and sequential streaming, over a ShardWriter directory.
+
+    Random access returns read-only views into memory-mapped shards; streaming
+    reads each shard front to back with plain buffered reads.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.records = []
+        with open(os.path.join(root, ShardWriter.INDEX)) as fil:
+            for line in fil:
+                try:
+                    self.records.append(json.loads(line))
+                except ValueError:
+                    # Torn final line from an interrupted writer
+                    continue
+        self._by_key = {rec['key']: ii for ii, rec in enumerate(self.records)}
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def keys(self):
+        return [rec['key'] for rec in self.records]
+
+    def _path(self, shard):
+        return os.path.join(self.root, 'shard-%05d.bin' % shard)
+
+    def _map(self, shard, end):
+        mm = self._maps.get(shard)
+        if mm is None or len(mm) < end:
+            # Shards still being appended to are remapped when a record lies past the old end
+            mm = numpy.memmap(self._path(shard), dtype=numpy.uint8, mode='r')
+            self._maps[shard] = mm
+        return mm
+
+    @staticmethod
+    def _unpack(rec, buf):
+        sample = dict(rec['meta'])
+        sample['key'] = rec['key']
+        for name, (offset, shape, dtype) in rec['arrays'].items():
+            dtype = numpy.dtype(dtype)
+            count = int(numpy.prod(shape))
+            sample[name] = buf[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        return sample
+
+    def __getitem__(self, idx):
+        rec = self.records[self._by_key[idx] if isinstance(idx, str) else idx]
+        mm = self._map(rec['shard'], rec['offset'] + rec['size'])
+        return self._unpack(rec, mm[rec['offset']:rec['offset'] + rec['size']])
+
+    def stream(self, shuffle_shards=False, seed=0):
+        """Yield every sample, shard by shard, in write order within a shard.
+
+        With shuffle_shards the shard order is permuted, which gives loaders a
+        cheap epoch-level shuffle without giving up sequential reads.
+        """
+        by_shard = {}
+        for rec in self.records:
+            by_shard.setdefault(rec['shard'], []).append(rec)
+        shards = sorted(by_shard)
+        if shuffle_shards:
+            random.Random(seed).shuffle(shards)
+
+        for shard in shards:
+            with open(self._path(shard), 'rb') as fil:
+                for rec in sorted(by_shard[shard], key=lambda rec: rec['offset']):
+                    fil.seek(rec['offset'])
+                    buf = numpy.frombuffer(fil.read(rec['size']), dtype=numpy.uint8)
+                    yield self._unpack(rec, buf)